@@ -1,10 +1,14 @@
 import argparse
 import datetime
 import sys
-from os.path import exists
+from os import listdir, makedirs, replace
+from os.path import basename, exists
 
 import utils.cli as cli
-from singlejson import sync, load
+import utils.errors as errors
+import utils.events as events
+import utils.jsonl as jsonl
+from utils.state import load, sync
 
 
 def get_time(timestamp: int) -> str:
@@ -16,6 +20,18 @@ def get_time(timestamp: int) -> str:
     return datetime.datetime.fromtimestamp(timestamp).strftime("%d.%m.%y at %H:%M:%S")
 
 
+def archived_events(dir_name: str) -> int:
+    """
+    Count the events in an archive
+    :param dir_name: name of the archive
+    :return: amount of events
+    """
+    if exists(f"data/archive/{dir_name}/events.json"):  # Archived before events.jsonl
+        return len(load(f"data/archive/{dir_name}/events.json").json)
+    return sum(jsonl.count(f"data/archive/{dir_name}/" + file) for file in listdir(f"data/archive/{dir_name}")
+               if file.startswith("events.jsonl"))
+
+
 def main(silent: bool):
     """
     Manage archives
@@ -24,17 +40,20 @@ def main(silent: bool):
     """
     cli.update_sender("ARM")
     cli.loading("Accessing archive database & current errors", vanish=True)
-    errors_file, events_file = load("data/errors.json", default=[]), load("data/events.json")
+    jsonl.migrate(errors.LEGACY_ERRORS_FILE, errors.ERRORS_FILE)
+    events.flush()
+    jsonl.migrate(events.LEGACY_EVENTS_FILE, events.settings["file"])
+    nr_errors, nr_events = jsonl.count(errors.ERRORS_FILE), sum(jsonl.count(file) for file in events.files())
     archive_info = load("data/archive/archive.json", default={"last": 0, "total": {"errors": 0, "events": 0}, "archives": []})
     last = archive_info.json["last"]
-    if len(events_file.json) == 0 and len(errors_file.json) == 0:
+    if nr_events == 0 and nr_errors == 0:
         cli.fail("Nothing to archive!")
         sys.exit()
     if silent:
         archive(last, int(datetime.datetime.now().timestamp()), silent)
         cli.success("Archive complete!")
         sys.exit()
-    cli.info(f"Preparing to archive {len(errors_file.json)} errors & {len(events_file.json)} events.")
+    cli.info(f"Preparing to archive {nr_errors} errors & {nr_events} events.")
     if cli.ask("Is this okay? (yes/y) ").lower() in ["y", "yes"]:
         archive(last, int(datetime.datetime.now().timestamp()), silent)
         cli.success("Archive complete!")
@@ -61,11 +80,19 @@ def archive(start: int, end: int, silent: bool):
         cli.fail("An archive with the same name already exists!")
         sys.exit()
 
-    archive_data, archived_errors, archived_events = load(f"data/archive/{dir_name}/data.json"), load(
-        f"data/archive/{dir_name}/errors.json"), load(f"data/archive/{dir_name}/events.json")
-    errors, events = load("data/errors.json", default="[]"), load("data/events.json", default="[]")
+    archive_data = load(f"data/archive/{dir_name}/data.json")
     archives_info = load("data/archive/archive.json")
-    nr_errors, nr_events = len(errors.json), len(events.json)
+    # errors.jsonl and events.jsonl (with its rotated files) are moved into the archive as a whole,
+    # they are created again on the next error / event
+    makedirs(f"data/archive/{dir_name}", exist_ok=True)
+    errors.close()
+    if exists(errors.ERRORS_FILE):
+        replace(errors.ERRORS_FILE, f"data/archive/{dir_name}/errors.jsonl")
+    events.flush()
+    for file in events.files():
+        if exists(file):
+            replace(file, f"data/archive/{dir_name}/" + basename(file))
+    nr_errors, nr_events = jsonl.count(f"data/archive/{dir_name}/errors.jsonl"), archived_events(dir_name)
     archive_data.json = {
         "timeframe": {
             "start": start,
@@ -76,10 +103,6 @@ def archive(start: int, end: int, silent: bool):
             "events": nr_events
         }
     }
-    archived_errors.json = errors.json
-    archived_events.json = events.json
-    errors.json = []
-    events.json = []
     archives_info.json["last"] = end
     archives_info.json["total"]["errors"] = archives_info.json["total"]["errors"] + nr_errors
     archives_info.json["total"]["events"] = archives_info.json["total"]["events"] + nr_events
@@ -105,18 +128,20 @@ def recount():
     archives_checked = 0
     for dir_name in archive_info.json["archives"]:
         progress.update_message(f"Counting {dir_name} ({archives_checked}/{archives})")
-        archive_data, archived_errors, archived_events = load(f"data/archive/{dir_name}/data.json"), load(
-            f"data/archive/{dir_name}/errors.json"), load(f"data/archive/{dir_name}/events.json")
-        nr_errors = len(archived_errors.json)
-        nr_events = len(archived_events.json)
+        archive_data = load(f"data/archive/{dir_name}/data.json")
+        if exists(f"data/archive/{dir_name}/errors.json"):  # Archived before errors.jsonl
+            nr_errors = len(load(f"data/archive/{dir_name}/errors.json").json)
+        else:
+            nr_errors = jsonl.count(f"data/archive/{dir_name}/errors.jsonl")
+        nr_events = archived_events(dir_name)
         archive_data.json["stats"]["errors"] = nr_errors
         archive_data.json["stats"]["events"] = nr_events
         total["events"] = total["events"] + nr_events
         total["errors"] = total["errors"] + nr_errors
     progress.complete("Checked all archives!", vanish=True)
-    errors, events = total["errors"], total["events"]
-    cli.success(f"Count complete: {errors} errors & {events} events!")
-    archive_info.json["total"]["errors"], archive_info.json["total"]["events"] = errors, events
+    nr_errors, nr_events = total["errors"], total["events"]
+    cli.success(f"Count complete: {nr_errors} errors & {nr_events} events!")
+    archive_info.json["total"]["errors"], archive_info.json["total"]["events"] = nr_errors, nr_events
     cli.simple_wait_fixed_time("Saving...", "Saved!", 3)
     archive_info.save()
 
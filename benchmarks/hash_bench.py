@@ -0,0 +1,183 @@
+"""
+Microbenchmark of the hashing in utils/sha244.py: throughput and peak memory of hashing a file
+by reading it whole (the old get_hash), through mmap and in blocks (hash_stream, different hash_buffer sizes),
+and the throughput of get_hashes (parallel) compared to get_hash one file after another.
+
+Usage: python benchmarks/hash_bench.py [size in MB ...] (default: 16 128 512)
+Every measurement runs in its own process (peak RSS), files are read once before measuring (warm page cache).
+Runs in a temporary folder, the data folder of the repository is not touched. Linux / macOS only (resource).
+"""
+import json
+import mmap
+import os
+import resource
+import subprocess
+import sys
+from hashlib import sha224
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import perf_counter
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 3
+STREAM_BUFFERS = [64, 1024, 8192]  # hash_buffer in KB
+PARALLEL_FILES = 8
+
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS of this process to the current RSS (linux 4.0+), so imports don't count
+    :return:
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass  # Not supported, the increase is measured from the current RSS
+
+
+def peak_rss() -> int:
+    """
+    Get the peak RSS of this process
+    :return: peak RSS in bytes
+    """
+    try:
+        with open("/proc/self/status", "r") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # linux reports KB
+
+
+def current_rss() -> int:
+    """
+    Get the current RSS of this process, the peak RSS if it is not available (not linux)
+    :return: RSS in bytes
+    """
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss()
+
+
+def load_program():
+    """
+    Import utils.sha244 with a configuration for benchmarking (no hash cache)
+    :return: the module
+    """
+    sys.path.insert(0, REPOSITORY)
+    os.makedirs("data", exist_ok=True)
+    if not os.path.exists("data/config.json"):
+        with open("data/config.json", "w") as file:
+            json.dump({"hash_cache": {"enabled": False, "file": "data/hash_cache.json", "verify_interval": 0}}, file)
+    import utils.sha244 as sha244
+    return sha244
+
+
+def measure(method: str, files: list, buffer: int) -> dict:
+    """
+    Hash files with a method, called in its own process
+    :param method: "read", "mmap", "stream", "sequential" or "parallel"
+    :param files: files to hash
+    :param buffer: hash_buffer in KB (stream, sequential, parallel)
+    :return: {seconds, rss (increase of the peak RSS over the RSS before hashing, in bytes)}
+    """
+    sha244 = load_program()
+    sha244.config["hash_buffer"] = buffer
+    reset_peak_rss()
+    before = current_rss()
+    start = perf_counter()
+    if method == "read":
+        with open(files[0], "rb") as file:
+            sha224(file.read()).hexdigest()
+    elif method == "mmap":
+        with open(files[0], "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            sha224(mapped).hexdigest()
+    elif method == "stream":
+        file_hash = sha224()
+        with open(files[0], "rb", buffering=0) as file:
+            sha244.hash_stream(file, [file_hash])
+        file_hash.hexdigest()
+    elif method == "sequential":
+        for file in files:
+            sha244.get_hash(file)
+    else:
+        sha244.get_hashes(files)
+    return {"seconds": perf_counter() - start, "rss": peak_rss() - before}
+
+
+def run(method: str, files: list, buffer: int = 1024) -> dict:
+    """
+    Measure a method RUNS times, every time in a new process
+    :param method: see measure
+    :param files: files to hash
+    :param buffer: hash_buffer in KB
+    :return: {seconds (best run), rss (largest increase)}
+    """
+    results = []
+    for _ in range(RUNS):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", method, str(buffer)] + files,
+                                check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+        results.append(json.loads(output.decode("utf-8").strip().splitlines()[-1]))
+    return {"seconds": min(result["seconds"] for result in results), "rss": max(result["rss"] for result in results)}
+
+
+def create_file(filename: str, size: int):
+    """
+    Write a file with random data and read it once, so it is in the page cache
+    :param filename: the file
+    :param size: size in bytes
+    :return:
+    """
+    with open(filename, "wb") as file:
+        for _ in range(size // (1024 * 1024)):
+            file.write(os.urandom(1024 * 1024))
+    with open(filename, "rb", buffering=0) as file:
+        while file.read(8 * 1024 * 1024):
+            pass
+
+
+def main(sizes: list):
+    """
+    Run the benchmark for files of the given sizes and print the results
+    :param sizes: file sizes in MB
+    :return:
+    """
+    methods = [("read()", "read", 0), ("mmap", "mmap", 0)] + \
+              [(f"stream {buffer}K", "stream", buffer) for buffer in STREAM_BUFFERS]
+    print("size     " + "".join(f"{name:<22}" for name, _, _ in methods))
+    for size in sizes:
+        create_file("bench.bin", size * 1024 * 1024)
+        line = f"{str(size) + 'MB':<9}"
+        for _, method, buffer in methods:
+            result = run(method, ["bench.bin"], buffer)
+            line = line + f"{size / result['seconds']:>6.0f} MB/s +{result['rss'] / 1024 / 1024:<4.0f}MB    "
+        print(line)
+        os.remove("bench.bin")
+
+    size = min(sizes)
+    files = [f"bench-{number}.bin" for number in range(PARALLEL_FILES)]
+    for file in files:
+        create_file(file, size * 1024 * 1024)
+    sequential = run("sequential", files)
+    parallel = run("parallel", files)
+    print(f"\n{PARALLEL_FILES} files of {size}MB: get_hash one after another {PARALLEL_FILES * size / sequential['seconds']:.0f} MB/s, "
+          f"get_hashes {PARALLEL_FILES * size / parallel['seconds']:.0f} MB/s "
+          f"({sequential['seconds'] / parallel['seconds']:.1f}x)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--measure":
+        print(json.dumps(measure(sys.argv[2], sys.argv[4:], int(sys.argv[3]))))
+        sys.exit()
+    folder = mkdtemp()
+    os.chdir(folder)
+    try:
+        main([int(size) for size in sys.argv[1:]] or [16, 128, 512])
+    finally:
+        os.chdir(REPOSITORY)
+        rmtree(folder, ignore_errors=True)
@@ -1,12 +1,15 @@
 import os
 import sys
 from time import sleep
+from typing import Union
 
 import utils.cli as cli
 from utils.file_defaults import CONFIG
-from singlejson import load, sync
+from utils.state import load, sync
 from utils.versions import is_valid, Version, VersionRangeRequirement
 from utils.context_manager import context
+from utils.scan import scan
+from utils.jar_metadata import metadata
 from utils.sha244 import get_hash
 
 
@@ -28,23 +31,8 @@ def main():
     for software, info in all_software.items():
         software_file_list[info["file"]] = software
 
-    detected_files = {}
-    files = []
-    with os.scandir(config["sources_folder"]) as directory:
-        for file in directory:
-            if not file.name.endswith(".tmp"):
-                files.append(file.name)
-            if file in software_file_list:
-                if get_hash(config["sources_folder"] + "/" + file) != all_software[software_file_list[file]]["hash"]:
-                    detected_files[file] = "changed"
-
-    for file in files:
-        if file not in software_file_list:
-            detected_files[file] = "added"
-
-    for file in software_file_list:
-        if file not in files:
-            detected_files[file] = "removed"
+    detected_files = scan(config["sources_folder"],
+                          {file: all_software[software]["hash"] for file, software in software_file_list.items()})
 
     if len(detected_files) == 0:
         cli.success("Scan complete, could not find any new / deleted / changed files!")
@@ -230,6 +218,7 @@ def add(file: str):
     """
     software_file = load("data/software.json", default="{}")
     all_software = software_file.json
+    config = load("data/config.json", default=CONFIG).json
 
     cli.update_sender("ADD")
     cli.info(f"Adding {file} to the software repository...")
@@ -273,20 +262,33 @@ def add(file: str):
 
     cli.update_sender("VER")
 
-    def ask_version(version: str) -> Version:
+    def ask_version(version: str, default: Union[str, None] = None) -> Version:
         """
         Ask for a specific version (e.g oldest or newest)
         :param version: version to ask for
+        :param default: version to use if nothing is entered
         :return: valid version object
         """
-        version = cli.ask("Please enter " + version + " version (e.g: 1.17.1): ")
-        if is_valid(version):
-            return Version(version)
-        cli.fail(f"{version} is not a valid version!")
-        return ask_version(version)
-
+        if default is None:
+            result = cli.ask("Please enter " + version + " version (e.g: 1.17.1): ")
+        else:
+            result = cli.ask("Please enter " + version + " version (default: " + default + "): ")
+            result = default if result == "" else result
+        if is_valid(result):
+            return Version(result)
+        cli.fail(f"{result} is not a valid version!")
+        return ask_version(version, default)
+
+    jar_metadata = metadata(config["sources_folder"] + "/" + file)
+    declared_version = None
+    if jar_metadata is not None:
+        cli.info("plugin.yml: " + str(jar_metadata.get("name", "?")) + " " + str(jar_metadata.get("version", "")))
+        if len(jar_metadata.get("depend", [])) != 0:
+            cli.info("Depends on: " + ", ".join(jar_metadata["depend"]))
+        if isinstance(jar_metadata.get("api-version"), str) and is_valid(jar_metadata["api-version"], verbose=False):
+            declared_version = jar_metadata["api-version"]
     cli.info("Define the range of compatible versions (includes the entered version)")
-    minimum = ask_version("oldest compatible")
+    minimum = ask_version("oldest compatible", declared_version)
     maximum = ask_version("newest compatible")
     range_requirement = VersionRangeRequirement((minimum, maximum))
 
@@ -306,7 +308,7 @@ def add(file: str):
 
     all_software[name] = {
         "file": file,
-        "hash": get_hash(file),
+        "hash": get_hash(config["sources_folder"] + "/" + file),
         "identifier": identifier,
         "requirements": range_requirement.dict(),
         "severity": severity,
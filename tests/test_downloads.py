@@ -0,0 +1,187 @@
+"""
+Regression test for single stream, segmented and resumed downloads (Source.fetch) against a local HTTP server
+Run with "python -m pytest tests" or "python tests/test_downloads.py" from the repository folder.
+The program runs in a temporary folder, the data folder of the repository is not touched.
+"""
+import json
+import os
+import sys
+from hashlib import sha224
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUILD = bytes(range(256)) * 40000  # 10 MB, larger than min_size of the segmented downloads
+ETAG = '"build-1"'
+
+
+class Progress:
+    """
+    Collects the failures instead of drawing a progress bar
+    """
+
+    def __init__(self):
+        self.failures = []
+
+    def update(self, done: int):
+        pass
+
+    def update_message(self, message: str, done: int = None):
+        pass
+
+    def fail(self, message: str):
+        self.failures.append(message)
+
+
+class BuildHandler(BaseHTTPRequestHandler):
+    """
+    Serves BUILD at /build.jar, supports single byte ranges (Range / If-Range) if the server has ranges enabled
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path != "/build.jar":
+            self.send_error(404)
+            return
+        start, end = 0, len(BUILD) - 1
+        partial = self.server.ranges and "Range" in self.headers and self.headers.get("If-Range", ETAG) == ETAG
+        if partial:
+            first, last = self.headers["Range"].replace("bytes=", "").split("-")
+            start, end = int(first), int(last) if last != "" else len(BUILD) - 1
+            self.server.range_requests.append((start, end))
+        self.send_response(206 if partial else 200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", ETAG)
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if partial:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(BUILD)}")
+        self.end_headers()
+        try:
+            self.wfile.write(BUILD[start:end + 1])
+        except ConnectionError:
+            pass  # The program closes the first response if it downloads the build in segments
+
+    def log_message(self, *args):
+        pass  # Keep the test output clean
+
+
+def setup_module():
+    """
+    Start the HTTP server and load the program in a temporary folder
+    :return:
+    """
+    global folder, server, source, DownloadHash, host_slot, url
+    folder = mkdtemp()
+    os.chdir(folder)
+    os.makedirs("data")
+    os.makedirs("software")
+    sys.path.insert(0, REPOSITORY)
+    from utils.file_defaults import CONFIG
+    config = dict(CONFIG, terminal_fallback_size=80, git_auto_update=False)
+    config["artifact_store"] = dict(CONFIG["artifact_store"], enabled=False)
+    config["segmented_downloads"] = {"enabled": True, "segments": 4, "min_size": 1}
+    with open("data/config.json", "w") as file:
+        json.dump(config, file)
+    with open("data/software.json", "w") as file:
+        json.dump({"build": {"file": "build.jar", "requirements": {"min": "1.19", "max": "1.20"}, "severity": 3}}, file)
+    with open("data/sources.json", "w") as file:
+        json.dump({"build": {"server": "local", "last_checked": 0, "build": {"local": 1}}}, file)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BuildHandler)
+    server.ranges = True
+    server.range_requests = []
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/build.jar"
+
+    from utils.source import Source
+    from utils.sha244 import DownloadHash
+    from utils.web import host_slot
+    source = Source("build")
+
+
+def teardown_module():
+    """
+    Stop the HTTP server and remove the temporary folder
+    :return:
+    """
+    server.shutdown()
+    os.chdir(REPOSITORY)
+    rmtree(folder, ignore_errors=True)
+
+
+def fetch() -> str:
+    """
+    Download the build like download_build does
+    :return: sha224 hash of the downloaded file (hashed while downloading)
+    """
+    download_hash = DownloadHash()
+    progress = Progress()
+    server.range_requests.clear()
+    with host_slot(url):
+        assert source.fetch(url, progress, download_hash), progress.failures
+    file_hash = download_hash.finish("software/build.jar.tmp")[0]
+    with open("software/build.jar.tmp", "rb") as file:
+        assert file.read() == BUILD
+    assert not os.path.exists("software/build.jar.resume.tmp")
+    os.remove("software/build.jar.tmp")
+    return file_hash
+
+
+def test_single_stream():
+    server.ranges = False
+    try:
+        assert fetch() == sha224(BUILD).hexdigest()
+        assert server.range_requests == []
+    finally:
+        server.ranges = True
+
+
+def test_segmented():
+    assert fetch() == sha224(BUILD).hexdigest()
+    assert len(server.range_requests) == 4
+    assert sum(end - start + 1 for start, end in server.range_requests) == len(BUILD)
+
+
+def test_resume_single_stream():
+    # Interrupted after 5 MB of a download that was written from the beginning
+    with open("software/build.jar.tmp", "wb") as file:
+        file.write(BUILD[:5000000])
+    source.save_resume_info(url, ETAG, len(BUILD), None)
+    assert fetch() == sha224(BUILD).hexdigest()
+    assert min(start for start, _ in server.range_requests) == 5000000
+
+
+def test_resume_segments():
+    # Interrupted segmented download, the file is preallocated and two ranges are still missing
+    missing = [[1000000, 2999999], [7000000, len(BUILD) - 1]]
+    with open("software/build.jar.tmp", "wb") as file:
+        file.write(BUILD)
+        for start, end in missing:
+            file.seek(start)
+            file.write(b"\0" * (end - start + 1))
+    source.save_resume_info(url, ETAG, len(BUILD), missing)
+    assert fetch() == sha224(BUILD).hexdigest()
+    assert sum(end - start + 1 for start, end in server.range_requests) == sum(end - start + 1 for start, end in missing)
+
+
+def test_resume_changed_build():
+    # The build changed upstream (other ETag), the partial file must not be used
+    with open("software/build.jar.tmp", "wb") as file:
+        file.write(b"\1" * 5000000)
+    source.save_resume_info(url, '"build-0"', len(BUILD), None)
+    assert fetch() == sha224(BUILD).hexdigest()
+    assert sum(end - start + 1 for start, end in server.range_requests) == len(BUILD)
+
+
+if __name__ == "__main__":
+    setup_module()
+    try:
+        for test in [test_single_stream, test_segmented, test_resume_single_stream, test_resume_segments,
+                     test_resume_changed_build]:
+            test()
+            print("passed: " + test.__name__)
+    finally:
+        teardown_module()
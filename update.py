@@ -1,37 +1,47 @@
+import json
 import os
 import sys
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from subprocess import run, PIPE
-from typing import Dict, List
+from typing import Dict, List, Union
 
-from singlejson import load, sync
+from utils.state import load, sync
 
 import utils.cli as cli
-from utils.access_fields import FileAccessField
 from utils.argparser import args
 from utils.context_manager import context
-from utils.dict_utils import enabled
+from utils.deploy_plan import execute_plan, installed_hashes, plan_servers
 from utils.errors import report
-from utils.events import report as report_event
+from utils.events import flush as flush_events, report as report_event
 from utils.file_defaults import CONFIG, VERSIONS
 from utils.software import Software
-from utils.static_info import DAYS_SINCE_EPOCH
-from utils.tasks import execute
+from utils.source import wait_for_refreshes
 from utils.versions import Version, check_game_versions
+from utils.rate_limit import waiting_times
+from utils.sha244 import get_hashes, hash_statistics
+from utils.staged_deploy import recover
+from utils.watch import watch
+from utils.web import cache_statistics, connection_statistics
 
 
-def main(check_all_compatibility: bool, re_download: List[str], skip_dependency_check: bool, debug_arg: bool):
+def main(check_all_compatibility: bool, re_download: List[str], skip_dependency_check: bool, debug_arg: bool,
+         plan_file: Union[str, None] = None):
     """
     Execute the main update.
     :param check_all_compatibility: Weather to check all software for updates
     :param re_download: Weather to re-download a specific software
     :param skip_dependency_check: Skip checking for new dependencies
     :param debug_arg: Weather the debug command line argument has been set
+    :param plan_file: Only print the deploy plan ("-") or save it to this file, without changing anything
     :return:
     """
     context.name = "main"
     context.failure_severity = 10
     context.task = "loading configurations"
+    plan_output = sys.stdout
+    if plan_file == "-":
+        sys.stdout = sys.stderr  # stdout only gets the plan, so it can be piped into other programs
 
     cli.update_sender("INI")
     cli.loading("Starting update, loading game version data...", vanish=True)
@@ -70,6 +80,11 @@ def main(check_all_compatibility: bool, re_download: List[str], skip_dependency_
         config["config_version"] = 3
         cli.success("configurations updated to version 3.")
 
+    # Settings introduced since version 3 only need their default value
+    for setting, default in CONFIG.items():
+        if setting not in config:
+            config[setting] = default
+
     if debug_arg:
         reset_debug = not config["debug"]
         if reset_debug:
@@ -77,7 +92,7 @@ def main(check_all_compatibility: bool, re_download: List[str], skip_dependency_
 
 
     context.task = "checking for git-updates"
-    if config["git_auto_update"]:
+    if config["git_auto_update"] and plan_file is None:
         cli.update_sender("GIT")
         cli.info("Checking for git updates [1/2]", vanish=True)
 
@@ -110,6 +125,7 @@ def main(check_all_compatibility: bool, re_download: List[str], skip_dependency_
                         cli.success("Updated to commit " + code.stdout.decode('utf-8'))
                         report_event("git", "Updated all files to commit " + code.stdout.decode('utf-8'))
                     cli.warn("Restarting update script!")
+                    flush_events()  # exec doesn't run atexit handlers
                     os.execl(sys.executable, sys.executable, *sys.argv)
 
     # Update software (fetch sources)
@@ -124,18 +140,39 @@ def main(check_all_compatibility: bool, re_download: List[str], skip_dependency_
     software_objects: Dict[str, Software] = {}
 
     for software_name, software_data in all_software.items():
-        checked = checked + 1
-        progress.update_message(f"Checking {software_name} [{checked}/{total_software}]",
-                                done=(checked / total_software) * 100)
-        software = Software(software_data, software_name)
-        if skip_dependency_check:
-            was_updated = False
-        else:
-            was_updated = software.retrieve_newest(check_all_compatibility,
-                                                   (update_all or (check_re_download and software.name in re_download)), software_data)
-        updated = updated + 1 if was_updated else updated
-        software_data["hash"] = software.hash
-        software_objects[software_name] = software
+        software_objects[software_name] = Software(software_data, software_name)
+
+    if skip_dependency_check or plan_file is not None:
+        # Only the network checks are skipped, files replaced in the sources folder are still deployed (and planned)
+        local_hashes = get_hashes([software.file for software in software_objects.values()])
+        was_updated: Dict[str, bool] = {}
+        for software_name, software in software_objects.items():
+            was_updated[software_name] = local_hashes[software.file] != software.hash
+            software.hash = local_hashes[software.file]
+    else:
+        # Sources are checked concurrently, every source only changes its own entries in software.json / sources.json
+        was_updated = {}
+        with ThreadPoolExecutor(max_workers=max(1, config["check_workers"])) as executor:
+            futures = {executor.submit(software.retrieve_newest, check_all_compatibility,
+                                       (update_all or (check_re_download and software.name in re_download)),
+                                       all_software[software_name]): software_name
+                       for software_name, software in software_objects.items()}
+            for future in as_completed(futures):
+                checked = checked + 1
+                progress.update_message(f"Checked {futures[future]} [{checked}/{total_software}]",
+                                        done=(checked / total_software) * 100)
+                was_updated[futures[future]] = future.result()
+        # Results served from the last run (max_staleness) that were refreshed in time and changed are used right away
+        for software_name, software in software_objects.items():
+            if software.refreshed():
+                progress.update_message(f"Checking {software_name} again with refreshed results")
+                was_updated[software_name] = software.retrieve_newest(
+                    check_all_compatibility, (update_all or (check_re_download and software_name in re_download)),
+                    all_software[software_name]) or was_updated[software_name]
+
+    for software_name, software_data in all_software.items():
+        updated = updated + 1 if was_updated[software_name] else updated
+        software_data["hash"] = software_objects[software_name].hash
 
     if updated == 0:
         progress.complete(f"Checked for {total_software} software updates")
@@ -145,169 +182,29 @@ def main(check_all_compatibility: bool, re_download: List[str], skip_dependency_
     context.name = "main"
     # Update servers
     cli.update_sender("SRV")
-    servers_total = len(servers.json)
-    servers_iter = 0
-    dependencies_updated = 0
-    updated_servers = 0
     progress = cli.progress_bar("Checking servers for updates")
-    for server_name, server_info in servers.json.items():
-        servers_iter = servers_iter + 1
-        context.name = server_name
-        context.failure_severity = 10
-        context.task = "getting information"
-        prog = (servers_iter / servers_total) * 100
-        progress.update_message(f"Updating {server_name} [{servers_iter}/{servers_total}]", prog)
-        changed = False
-        # Get the server version
-        if server_info["version"]["type"] == "version":
-            server_version = Version(server_info["version"]["value"])
+    if plan_file is None:
+        # Finish staged deployments that were interrupted last time before looking at the servers
+        for server_name, server_info in servers.json.items():
+            recover(server_name, server_info["path"], config.get("fsync", CONFIG["fsync"]))
+    progress.update_message("Hashing software in servers")
+    installed = installed_hashes(servers.json, all_software)
+
+    progress.update_message("Planning deployment")
+    plan = plan_servers(servers.json, all_software, software_objects, current_game_version, installed)
+    if plan_file is not None:
+        progress.complete(f"Planned {sum(len(server_plan['copies']) for server_plan in plan.values())} copies "
+                          f"and {sum(len(server_plan['increments']) for server_plan in plan.values())} version increments")
+        if plan_file == "-":
+            sys.stdout = plan_output
+            print(json.dumps(plan, indent=4))
+            sys.stdout.flush()
         else:
-            version_access = FileAccessField(server_info["version"]["value"])
-            server_version = Version(version_access.access())
-        # game version detection for dependency
-        if "auto_update" in server_info:
-            context.failure_severity = 5
-            context.task = "auto-updating server, getting eligible versions"
-            # Check if server dependencies are ready
-            # If an auto update is even required
-            if server_info["auto_update"]["enabled"]:
-                if not server_version.matches(current_game_version):
-                    # Possibly out of date
-                    version_iter = server_version
-                    higher_versions = []
-                    while not version_iter.matches(current_game_version):
-                        higher_version = version_iter.get_next_minor()
-                        if higher_version.matches(version_iter):
-                            # highest version already reached / server uses higher version than in database
-                            break
-                        higher_versions.append(higher_version)
-                        version_iter = higher_version
-                    for version in higher_versions:
-                        context.task = "auto-updating server, checking " + version.string()
-                        if not version.string() in server_info["auto_update"]["blocking"]:
-                            server_info["auto_update"]["blocking"][version.string()] = {}
-                        ready = True  # ready = ready for version increment
-                        failing = 0
-                        progress.update_message(
-                            "Checking " + server_name + " version compatibility for " + version.string())
-                        dep_iter = 0
-                        dependencies_total = len(server_info["software"])
-                        for dependency in server_info["software"]:
-                            progress.update((dep_iter / dependencies_total) * 100)
-                            if not server_info["software"][dependency]["enabled"]:
-                                if dependency in server_info["auto_update"]["blocking"][version.string()]:
-                                    server_info["auto_update"]["blocking"][version.string()].pop(dependency)
-                                continue
-                            if dependency not in all_software:
-                                # >> Typo in config
-                                cli.fail(
-                                    "Error while updating " + server_name + " server: required software " + dependency + " not found in software register")
-                                report(2, "updater - " + server_name,
-                                       "Server has unknown dependency, server dependency file might have a typo!")
-                                continue
-                            software = software_objects[dependency]
-                            if not version.fulfills(
-                                    software.requirements):  # If there is no next minor, there IS no higher version -> the server is at MAX version which was ruled out above!
-                                ready = False  # Plugin incompatibility found, abort
-                                failing = failing + 1
-                                if dependency in server_info["auto_update"]["blocking"][version.string()]:
-                                    diff = DAYS_SINCE_EPOCH - \
-                                           server_info["auto_update"]["blocking"][version.string()][dependency]
-                                    if diff >= 3:
-                                        report(int(min(max(2, 2 + (diff * 0.2)), 5)), "updater - " + server_name,
-                                               "Server " + server_name + " is set to auto update, yet the dependency \"" + dependency + "\" has been blocking the automatic increment for " + str(
-                                                   diff) + " days",
-                                               additional="Server version: " + server_version.string() + " " + dependency + " version requirement: " + software.requirements.string())
-                                else:
-                                    server_info["auto_update"]["blocking"][version.string()][
-                                        dependency] = DAYS_SINCE_EPOCH
-
-                            else:
-                                if dependency in server_info["auto_update"]["blocking"][version.string()]:
-                                    server_info["auto_update"]["blocking"][version.string()].pop(dependency)
-
-                        if ready:  # Ready to version increment!
-                            context.task = "server eligible for update!"
-                            if server_version.is_higher(version):
-                                # Don't "downgrade" or "upgrade" to the "same version" (current game version can be in the pool twice)
-                                server_info["auto_update"]["blocking"].pop(version.string())
-                                continue
-                            changed = True
-                            if server_info["version"]["type"] == "version":  # Save version as string
-                                server_info["version"]["value"] = version.string()
-                            else:
-                                version_access = FileAccessField(server_info["version"])
-                                version_access.update(version.string())
-                            server_info["auto_update"]["blocking"].pop(version.string())
-                            progress.update_message(
-                                "Updating " + server_name + " from " + server_version.string() + " to " + version.string())
-                            update = True
-                            if "on_update" in server_info["auto_update"]:
-                                # Execute tasks
-                                context.failure_severity = 8
-                                context.name = server_name
-                                context.task = "updating server to " + version.string()
-                                for task in server_info["auto_update"]["on_update"]:
-                                    if enabled(task):
-                                        progress.update_message(task["progress"]["message"],
-                                                                done=task["progress"]["value"])
-                                        if not execute(task, server_info["path"],
-                                                       {"%old_version%": server_version.string(),
-                                                        "%new_version%": version.string()}):
-                                            # Error while executing task
-                                            update = False
-                                            progress.fail(
-                                                "Could not update " + server_name + " to " + version.string() + ". See errors.json")
-                                            report(8, "update of " + server_name,
-                                                   "could not execute all update tasks. some things may need to be cleaned up.",
-                                                   additional="script doesn't clean up automatically.")
-                                            break
-                            if update:
-                                server_version = version
-                                report_event("updater - " + server_name,
-                                             "Server updated to " + version.string())
-                                progress.complete("Updated " + server_name + " to " + version.string() + "!")
-
-                        else:
-                            progress.fail(server_name + " not compatible with " + version.string() + "(" + str(
-                                failing) + " non-compatible)")
-
-                else:  # Version up to date
-                    server_info["auto_update"]["blocking"] = {}
-
-        context.failure_severity = 8
-        context.name = server_name
-        context.task = "updating dependencies"
-        dependencies_total = len(server_info["software"])
-        dep_iter = 0
-        progress.update_message(f"Checking {server_name} dependencies [{dep_iter}/{dependencies_total}]", done=prog)
-        for dependency, info in server_info["software"].items():
-            dep_iter = dep_iter + 1
-            progress.update_message(f"Checking {server_name} dependencies [{dep_iter}/{dependencies_total}]")
-            if dependency not in all_software:
-                # >> Typo in config
-                cli.fail(
-                    "Error while updating " + server_name + " server: required software " + dependency + " not found in software register")
-                report(8, "updater - " + server_name,
-                       "Server has unknown dependency, server dependency file might have a typo!")
-                continue
-            software = software_objects[dependency]
-            context.task = "updating " + dependency
-            if not server_info["software"][dependency]["enabled"]:
-                continue
-            if server_version.fulfills(software.requirements) and software.needs_update(server_info["path"] + info["copy_path"]):
-                # Skip update if no update happened
-                # Software IS compatible, copy is allowed > copy
-                context.task = "copying " + dependency
-                progress.update_message(f"Updating {server_name} dependencies - {dependency}")
-                software.copy(server_name)
-                changed = True
-                dependencies_updated = dependencies_updated + 1
-
-        progress.complete(f"Updated {server_name} [{dep_iter}/{dependencies_total}]", vanish=True)
-
-        updated_servers = updated_servers + 1 if changed else updated_servers
-        servers.json[server_name] = server_info
+            with open(plan_file, "w") as file:
+                json.dump(plan, file, indent=4)
+            cli.success(f"Plan saved to {plan_file}, nothing has been changed.")
+        return
+    dependencies_updated, updated_servers = execute_plan(plan, servers.json, software_objects, progress)
 
     context.failure_severity = 10
     context.task = "finalizing"
@@ -318,15 +215,35 @@ def main(check_all_compatibility: bool, re_download: List[str], skip_dependency_
         progress.complete(f"Checked {len(servers.json)} servers for updates.")
 
     cli.update_sender("END")
+    hits, coalesced, misses = cache_statistics()
+    cli.info(f"Web cache: {hits} hits, {coalesced} coalesced, {misses} misses")
+    hits, misses = hash_statistics()
+    cli.info(f"Hash cache: {hits} hits, {misses} files hashed")
+    if config["debug"]:
+        web_requests, connections = connection_statistics()
+        cli.info(f"Made {web_requests} web requests using {connections} connections "
+                 f"({web_requests - connections} reused)")
+        for host, waited in waiting_times().items():
+            if waited > 0:
+                cli.info(f"Requests to {host} waited {round(waited, 1)}s for rate limits")
     if debug_arg and reset_debug:
         config["debug"] = False
+    cli.info("Waiting for background refreshes...", vanish=True)
+    wait_for_refreshes()
     cli.simple_wait_fixed_time("Saving data to disk...", "Data saved!", 1.5, green=True)
+    flush_events()
     sync()
 
 
 if __name__ == "__main__":
     try:
-        main(args.check_all_compatibility, args.redownload, args.skip_dependency_check, args.debug)
+        main(args.check_all_compatibility, args.redownload, args.skip_dependency_check, args.debug, args.plan)
+        if args.watch and args.plan is None:
+            watch()
+    except BrokenPipeError:
+        # The output was piped into a program that quit early (e.g. head), nothing can be shown anymore
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.__stdout__.fileno())  # Don't fail again when flushing at exit
+        sys.exit(1)
     except KeyboardInterrupt:
         cli.fail("operation aborted, no data saved!")
         cli.fail(f"{context.name} - {context.task}")
@@ -339,7 +256,7 @@ if __name__ == "__main__":
                    exception=e)
             cli.fail("ERROR: Uncaught exception: ")
             print(e)
-            cli.fail("More detailed info can be found in the errors.json file")
+            cli.fail("More detailed info can be found in the errors.jsonl file")
 
 
 else:
@@ -6,9 +6,10 @@ from typing import Union, Dict, List, Tuple
 from utils.errors import report
 from utils.context_manager import context
 from utils.file_defaults import CONFIG
-from singlejson import load
+from .state import load
 
 from utils.versions import Version, DEFAULT_VERSION
+from utils.json_stream import Projection
 from utils.web import get_managed
 from utils.versions import is_valid
 
@@ -94,6 +95,15 @@ def uri_access(path: List[str], json: dict):
     return data
 
 
+def streamed(task: dict) -> bool:
+    """
+    Check if only the needed part of the response should be extracted (and cached) for a task
+    :param task: WebAccessField task
+    :return: Weather or not the task is streamed
+    """
+    return "stream" in task and task["stream"]
+
+
 class WebAccessField:
     """
     WebAccessField, a component that can easily retrieve information from the internet
@@ -132,12 +142,14 @@ class WebAccessField:
             result = result.replace(this, str(that))
         return result
 
-    def execute(self, replaceable: Dict[str, str], requres_return: bool = True, headers: Dict = load("data/config.json", default=CONFIG).json["default_headers"]) -> Union[int, str, List, Dict, bool, None, Exception]:
+    def execute(self, replaceable: Dict[str, str], requres_return: bool = True, headers: Dict = load("data/config.json", default=CONFIG).json["default_headers"],
+                max_age: Union[int, None] = None) -> Union[int, str, List, Dict, bool, None, Exception]:
         """
         Execute the WebAccessField, get the desired value
         :param replaceable: Standard replaceable values
         :param requres_return: Weather a value needs to be returned
         :param headers: The default headers to use
+        :param max_age: Time (seconds) a cached response may be used without revalidation, None for the default
         :return: The retrieved value
         """
         self.replaceable = replaceable
@@ -154,7 +166,8 @@ class WebAccessField:
                 task_headers = headers  # Task specific headers
                 if "headers" in task:
                     task_headers = task["headers"]  # Task headers should only be used for THIS task
-                result = get_managed(self.replace(task["url"]), task_headers)
+                result = get_managed(self.replace(task["url"]), task_headers, max_age=max_age,
+                                     projection=Projection(task["path"]) if streamed(task) else None)
                 if isinstance(result, Exception):
                     return result
                 if task["type"] == "get_return_clean":
@@ -182,7 +195,8 @@ class WebAccessField:
                 if "headers" in task:
                     task_headers = task["headers"]  # Task headers should only be used for THIS task
                 destination = task["destination"]
-                result = get_managed(self.replace(task["url"]), task_headers)
+                result = get_managed(self.replace(task["url"]), task_headers, max_age=max_age,
+                                     projection=Projection(task["path"]) if streamed(task) else None)
                 if isinstance(result, Exception):
                     return result
                 self.replaceable[f"%{destination}%"] = uri_access(task["path"], result)
@@ -224,7 +238,7 @@ class WebAccessField:
                            additional=f"task data: {task}",
                            software=context.name)
                     return WebAccessFieldError(
-                        "malformed \"" + task["type"] + "\" task, \"sort_type\" is unknown (see errors.json)!")
+                        "malformed \"" + task["type"] + "\" task, \"sort_type\" is unknown (see errors.jsonl)!")
                 if task["sort_type"] == "release_type" and "match" not in task:
                     report(context.failure_severity, f"WebAccessField - {context.name} - {context.task}",
                            "malformed " + task["type"] + " task. \"match\" is missing",
@@ -235,7 +249,9 @@ class WebAccessField:
                 task_headers = headers
                 if "headers" in task:
                     task_headers = task["headers"]  # Task headers should only be used for THIS task
-                result = get_managed(self.replace(task["url"]), task_headers)
+                result = get_managed(self.replace(task["url"]), task_headers, max_age=max_age,
+                                     projection=Projection(task["path"], [task["sort_by"], task["attribute"]])
+                                     if streamed(task) else None)
                 if isinstance(result, Exception):
                     return result
                 sortable_data = uri_access(task["path"], result)
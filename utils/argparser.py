@@ -12,4 +12,8 @@ _ = parser.add_argument('--skip-dependency-check', dest='skip_dependency_check',
                         help="Skip looking for new software builds (for testing)")
 _ = parser.add_argument('--debug', dest='debug', action="store_true", default=False,
                         help="Enable debug mode for this run.")
+_ = parser.add_argument('--plan', dest='plan', nargs='?', const="-", default=None,
+                        help="Only show what would be deployed into the servers (as JSON), optionally save it to a file")
+_ = parser.add_argument('--watch', dest='watch', action="store_true", default=False,
+                        help="Keep running and deploy software as soon as it is changed (linux only)")
 args = parser.parse_args()
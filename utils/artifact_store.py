@@ -0,0 +1,154 @@
+"""
+Content addressed store for downloaded builds, the files in the sources folder are hard links to the stored builds.
+Stored builds are read-only, so they can't be changed through the links.
+"""
+from os import chmod, link, makedirs, path, remove, stat
+from threading import Lock
+from time import time
+from typing import Dict, Union
+
+from singlejson import load
+
+from .file_defaults import CONFIG
+from .io import clone_file, replace_file
+from .sha244 import get_hash
+
+config = load("data/config.json", default=CONFIG).json
+settings: dict = config.get("artifact_store", CONFIG["artifact_store"])
+STORE_DIR = settings["folder"]
+# objects: {digest: {size, stored}}, builds: {software: {build: {digest, stored}}}, current: {software: digest}
+index = load(STORE_DIR + "/index.json", default='{"objects": {}, "builds": {}, "current": {}}')
+lock = Lock()
+
+
+def object_file(digest: str) -> str:
+    """
+    Get the file a build is stored in
+    :param digest: sha224 hash of the build
+    :return: the filename
+    """
+    return STORE_DIR + "/" + digest
+
+
+def enabled() -> bool:
+    """
+    Check if builds are stored
+    :return: Weather or not the store is enabled
+    """
+    return settings["enabled"]
+
+
+def add(file: str, digest: str, software: str, build, fsync_policy: str):
+    """
+    Move a downloaded build into the store, identical builds are only stored once
+    :param file: the downloaded build (removed afterwards)
+    :param digest: sha224 hash of the build
+    :param software: name of the software
+    :param build: build ID
+    :param fsync_policy: see config.json fsync
+    :return:
+    """
+    with lock:
+        makedirs(STORE_DIR, exist_ok=True)
+        if digest in index.json["objects"] and path.exists(object_file(digest)):
+            remove(file)  # Already stored
+        else:
+            size = stat(file).st_size
+            replace_file(file, object_file(digest), fsync_policy)
+            chmod(object_file(digest), 0o444)
+            index.json["objects"][digest] = {"size": size, "stored": time()}
+        if software not in index.json["builds"]:
+            index.json["builds"][software] = {}
+        index.json["builds"][software][str(build)] = {"digest": digest, "stored": time()}
+
+
+def lookup(software: str, build) -> Union[str, None]:
+    """
+    Look up a stored build, the stored file is verified
+    :param software: name of the software
+    :param build: build ID
+    :return: sha224 hash of the build or None if it is not stored (anymore)
+    """
+    if not enabled():
+        return None
+    with lock:
+        builds = index.json["builds"].get(software, {})
+        if str(build) not in builds or not path.exists(object_file(builds[str(build)]["digest"])):
+            return None
+        digest = builds[str(build)]["digest"]
+    if get_hash(object_file(digest)) != digest:
+        with lock:
+            builds.pop(str(build), None)
+            collect()
+        return None
+    return digest
+
+
+def deploy(digest: str, software: str, destination: str):
+    """
+    Make a file a view onto a stored build. The view is a hard link to the read-only stored build, every build is only
+    written once. If the sources folder is on another filesystem the view is a reflink (or a copy).
+    :param digest: sha224 hash of the build
+    :param software: name of the software
+    :param destination: file in the sources folder
+    :return:
+    """
+    chmod(object_file(digest), 0o444)  # Builds stored by older versions are writable
+    if not path.exists(destination) or not path.samefile(destination, object_file(digest)):
+        if path.exists(destination + ".view"):
+            remove(destination + ".view")
+        try:
+            link(object_file(digest), destination + ".view")
+            replace_file(destination + ".view", destination, "never")  # The stored build has already been flushed
+        except OSError:
+            if path.exists(destination + ".view"):
+                remove(destination + ".view")
+            if not path.exists(destination) or get_hash(destination) != digest:  # Links not possible, copy once
+                clone_file(object_file(digest), destination + ".view")
+                replace_file(destination + ".view", destination, "never")
+    with lock:
+        index.json["current"][software] = digest
+        collect()
+        index.save()
+
+
+def references() -> Dict[str, int]:
+    """
+    Count the references to every stored build (build history and current builds), the lock has to be held
+    :return: {digest: references}
+    """
+    counts = {digest: 0 for digest in index.json["objects"]}
+    for builds in index.json["builds"].values():
+        for build in builds.values():
+            counts[build["digest"]] = counts.get(build["digest"], 0) + 1
+    for digest in index.json["current"].values():
+        counts[digest] = counts.get(digest, 0) + 1
+    return counts
+
+
+def collect():
+    """
+    Remove builds that are not referenced anymore, then forget the oldest builds until the store fits into the configured size.
+    Current builds are never removed. The lock has to be held.
+    :return:
+    """
+    counts = references()
+    current = set(index.json["current"].values())
+    history = sorted(((build["stored"], software, build_id) for software, builds in index.json["builds"].items()
+                      for build_id, build in builds.items() if build["digest"] not in current))
+    total = sum(stored["size"] for stored in index.json["objects"].values())
+    max_size = settings["max_size"] * 1024 * 1024
+    for _, software, build_id in history:
+        if total <= max_size:
+            break
+        digest = index.json["builds"][software].pop(build_id)["digest"]
+        counts[digest] = counts[digest] - 1
+        if counts[digest] == 0:
+            total = total - index.json["objects"][digest]["size"]
+    for digest, count in counts.items():
+        if count <= 0 and digest in index.json["objects"]:
+            index.json["objects"].pop(digest)
+            try:
+                remove(object_file(digest))
+            except OSError:
+                pass  # Already gone
@@ -5,6 +5,7 @@ from __future__ import annotations
 
 from math import floor
 import sys
+from threading import Lock, current_thread, main_thread
 from time import sleep
 from typing import Callable, Union
 
@@ -118,6 +119,7 @@ class SenderHolder:
 
 
 sender = SenderHolder()
+output_lock = Lock()  # Sources are checked concurrently, don't mix up lines
 
 
 def print_pretty(color: str, symbol: str, message: str, vanish: bool, enable_len_check: bool = True):
@@ -138,7 +140,8 @@ def print_pretty(color: str, symbol: str, message: str, vanish: bool, enable_len
     if len(message) + 8 > terminal_size and enable_len_check:
         # WON'T FIT IN ONE LINE
         message = cut_string(message, terminal_size - 8)
-    print('\r\x1b[2K\r' + color + symbol + sender.get_sender() + color + " " + message, end=end + Style.RESET_ALL)
+    with output_lock:
+        print('\r\x1b[2K\r' + color + symbol + sender.get_sender() + color + " " + message, end=end + Style.RESET_ALL)
 
 
 def update_sender(new_sender: str):
@@ -264,7 +267,8 @@ def simple_wait_fixed_time(message: str, end_message: str, time: Union[int, floa
 
 def progress_bar(message, progress: int = 0):
     """
-    Return a progress bar object
+    Return a progress bar object. Only progress bars of the main thread are drawn, the bars of concurrent workers
+    (e.g. downloads while checking sources) would overwrite each other. Failures are always shown.
     :param progress: Initial progress
     :param message: Starting message to display
     :return: A ProgressBar object
@@ -331,6 +335,8 @@ def progress_bar(message, progress: int = 0):
             :param green: Wetter to use green color coding
             :return:
             """
+            if vanish and current_thread() is not main_thread():
+                return  # Nothing to clean up, the bar has not been drawn
             if green:
                 print_pretty(Fore.GREEN, "✔", complete_message, vanish)
             else:
@@ -350,6 +356,8 @@ def progress_bar(message, progress: int = 0):
             Show the ProgressBar
             :return:
             """
+            if current_thread() is not main_thread():
+                return
             done_modified = int(self.__progress * self.__multiplier)
             print_pretty(Fore.CYAN, "⤓", "[" + ('=' * done_modified) +
                          (' ' * int(100 * self.__multiplier - done_modified)) + '] ' + self.__message,
@@ -1,11 +1,13 @@
 """
 The main context handler to enable more precise error logs etc.
 """
+from threading import local
 
 
-class Context:
+class Context(local):
     """
     Describes the current context that the program is in
+    Every thread has its own context, the class attributes are the defaults
     """
 
     task: str = "initializing"  # task always with "ing" at the end
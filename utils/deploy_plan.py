@@ -0,0 +1,316 @@
+"""
+Plan and execute the deployment of software into the servers
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import path, stat
+from threading import BoundedSemaphore
+from typing import Dict, List, Set, Tuple, Union
+
+from singlejson import load
+
+import utils.cli as cli
+from .access_fields import FileAccessField
+from .context_manager import context
+from .dict_utils import enabled
+from .errors import report
+from .events import report as report_event
+from .deployments import deployed_hash, record
+from .file_defaults import CONFIG
+from .sha244 import get_hashes
+from .staged_deploy import JOURNAL, commit, discard, prepare, staging_file
+from .static_info import DAYS_SINCE_EPOCH
+from .tasks import execute
+from .versions import Version, VersionRangeRequirement
+
+
+def server_version_of(server_info: dict) -> Version:
+    """
+    Get the version of a server
+    :param server_info: server data (servers.json)
+    :return: the version
+    """
+    if server_info["version"]["type"] == "version":
+        return Version(server_info["version"]["value"])
+    return Version(FileAccessField(server_info["version"]["value"]).access())
+
+
+def installed_hashes(servers: dict, all_software: dict, only: Union[Set[Tuple[str, str]], None] = None) -> Dict[str, str]:
+    """
+    Get the hashes of the software in the servers.
+    Software deployed by us is known from the manifest, the rest is hashed at once instead of one file after another
+    :param servers: all server data (servers.json)
+    :param all_software: software data (software.json)
+    :param only: only get the hashes of these (server, software)
+    :return: {file: hash}
+    """
+    hashes = {}
+    for server_name, server_info in servers.items():
+        for dependency, info in server_info["software"].items():
+            if info["enabled"] and dependency in all_software and (only is None or (server_name, dependency) in only):
+                hashes[server_info["path"] + info["copy_path"]] = \
+                    deployed_hash(server_name, server_info["path"] + info["copy_path"])
+    hashes.update(get_hashes([destination for destination, installed_hash in hashes.items()
+                              if installed_hash is None and path.exists(destination)]))
+    return hashes
+
+
+def plan_server(server_name: str, server_info: dict, all_software: dict, software_objects: dict,
+                current_game_version: Version, installed_hashes: Dict[str, str]) -> dict:
+    """
+    Decide what has to be done for a server without changing anything
+    :param server_name: name of the server
+    :param server_info: server data (servers.json)
+    :param all_software: software data (software.json)
+    :param software_objects: Software objects of all software
+    :param current_game_version: the newest game version
+    :param installed_hashes: known hashes of the software in the servers {file: hash}
+    :return: the plan for the server (JSON serializable)
+    """
+    context.name = server_name
+    context.task = "planning"
+    server_version = server_version_of(server_info)
+    server_plan = {"version": server_version.string(), "up_to_date": server_version.matches(current_game_version),
+                   "checked": [], "blocked": {}, "increments": [],
+                   "copies": [], "skips": [],
+                   "unknown": [dependency for dependency in server_info["software"] if dependency not in all_software]}
+    if "auto_update" in server_info and server_info["auto_update"]["enabled"] \
+            and not server_version.matches(current_game_version):
+        # Possibly out of date
+        version_iter = server_version
+        higher_versions = []
+        while not version_iter.matches(current_game_version):
+            higher_version = version_iter.get_next_minor()
+            if higher_version.matches(version_iter):
+                # highest version already reached / server uses higher version than in database
+                break
+            higher_versions.append(higher_version)
+            version_iter = higher_version
+        for version in higher_versions:
+            server_plan["checked"].append(version.string())
+            blocking = {dependency: software_objects[dependency].requirements.string()
+                        for dependency, info in server_info["software"].items()
+                        if info["enabled"] and dependency in all_software
+                        and not version.fulfills(software_objects[dependency].requirements)}
+            if len(blocking) != 0:
+                server_plan["blocked"][version.string()] = blocking
+                continue
+            if server_version.is_higher(version):
+                # Don't "downgrade" or "upgrade" to the "same version" (current game version can be in the pool twice)
+                continue
+            server_plan["increments"].append({"from": server_version.string(), "to": version.string()})
+            server_version = version
+
+    for dependency, info in server_info["software"].items():
+        destination = server_info["path"] + info["copy_path"]
+        if dependency not in all_software:
+            continue
+        if not info["enabled"]:
+            server_plan["skips"].append({"software": dependency, "destination": destination, "reason": "disabled"})
+            continue
+        software = software_objects[dependency]
+        if not server_version.fulfills(software.requirements):
+            server_plan["skips"].append({"software": dependency, "destination": destination, "reason": "incompatible"})
+        elif not path.exists(destination) or software.needs_update(destination, installed_hashes.get(destination)):
+            server_plan["copies"].append({"software": dependency, "destination": destination,
+                                          "requirements": software.requirements.dict()})
+        else:
+            server_plan["skips"].append({"software": dependency, "destination": destination, "reason": "up to date"})
+    return server_plan
+
+
+def plan_servers(servers: dict, all_software: dict, software_objects: dict, current_game_version: Version,
+                 installed_hashes: Dict[str, str]) -> Dict[str, dict]:
+    """
+    Build the deploy plan for all servers
+    :param servers: all server data (servers.json)
+    :param all_software: software data (software.json)
+    :param software_objects: Software objects of all software
+    :param current_game_version: the newest game version
+    :param installed_hashes: known hashes of the software in the servers {file: hash}
+    :return: {server: plan}
+    """
+    return {server_name: plan_server(server_name, server_info, all_software, software_objects, current_game_version,
+                                     installed_hashes)
+            for server_name, server_info in servers.items()}
+
+
+def apply_versions(server_name: str, server_info: dict, server_plan: dict, progress) -> Tuple[Version, bool]:
+    """
+    Update the auto update information of a server and increment its version according to the plan
+    :param server_name: name of the server
+    :param server_info: server data (servers.json)
+    :param server_plan: plan of the server
+    :param progress: ProgressBar to display progress in
+    :return: (version of the server afterwards, weather or not the server has been changed)
+    """
+    server_version = Version(server_plan["version"])
+    changed = False
+    for dependency in server_plan["unknown"]:
+        # >> Typo in config
+        cli.fail("Error while updating " + server_name + " server: required software " + dependency + " not found in software register")
+        report(8, "updater - " + server_name, "Server has unknown dependency, server dependency file might have a typo!")
+    if "auto_update" not in server_info or not server_info["auto_update"]["enabled"]:
+        return server_version, changed
+    if server_plan["up_to_date"]:
+        server_info["auto_update"]["blocking"] = {}
+        return server_version, changed
+    context.failure_severity = 5
+    context.task = "auto-updating server, checking eligible versions"
+    blocking_versions = server_info["auto_update"]["blocking"]
+    for version in server_plan["checked"]:
+        if version not in server_plan["blocked"]:
+            blocking_versions.pop(version, None)
+            continue
+        previous = blocking_versions[version] if version in blocking_versions else {}
+        blocking_versions[version] = {}
+        for dependency in server_plan["blocked"][version]:
+            blocking_versions[version][dependency] = previous[dependency] if dependency in previous else DAYS_SINCE_EPOCH
+            diff = DAYS_SINCE_EPOCH - blocking_versions[version][dependency]
+            if diff >= 3:
+                report(int(min(max(2, 2 + (diff * 0.2)), 5)), "updater - " + server_name,
+                       "Server " + server_name + " is set to auto update, yet the dependency \"" + dependency + "\" has been blocking the automatic increment for " + str(diff) + " days",
+                       additional="Server version: " + server_version.string() + " " + dependency + " version requirement: " +
+                                  server_plan["blocked"][version][dependency])
+        progress.fail(server_name + " not compatible with " + version + "(" + str(len(server_plan["blocked"][version])) + " non-compatible)")
+
+    for increment in server_plan["increments"]:
+        version = Version(increment["to"])
+        context.task = "server eligible for update!"
+        changed = True
+        if server_info["version"]["type"] == "version":  # Save version as string
+            server_info["version"]["value"] = version.string()
+        else:
+            FileAccessField(server_info["version"]["value"]).update(version.string())
+        progress.update_message("Updating " + server_name + " from " + server_version.string() + " to " + version.string())
+        if "on_update" in server_info["auto_update"]:
+            # Execute tasks
+            context.failure_severity = 8
+            context.name = server_name
+            context.task = "updating server to " + version.string()
+            for task in server_info["auto_update"]["on_update"]:
+                if enabled(task):
+                    progress.update_message(task["progress"]["message"], done=task["progress"]["value"])
+                    if not execute(task, server_info["path"], {"%old_version%": server_version.string(),
+                                                               "%new_version%": version.string()}):
+                        # Error while executing task
+                        progress.fail("Could not update " + server_name + " to " + version.string() + ". See errors.jsonl")
+                        report(8, "update of " + server_name,
+                               "could not execute all update tasks. some things may need to be cleaned up.",
+                               additional="script doesn't clean up automatically.")
+                        return server_version, changed  # Further increments and copies use the old version
+        server_version = version
+        report_event("updater - " + server_name, "Server updated to " + version.string())
+        progress.complete("Updated " + server_name + " to " + version.string() + "!")
+    return server_version, changed
+
+
+def device(file: str) -> int:
+    """
+    Get the filesystem a file is (going to be) on
+    :param file: the file
+    :return: device ID
+    """
+    directory = path.dirname(path.abspath(file))
+    while not path.exists(directory) and path.dirname(directory) != directory:
+        directory = path.dirname(directory)
+    return stat(directory).st_dev
+
+
+def execute_plan(plan: Dict[str, dict], servers: dict, software_objects: dict, progress) -> Tuple[int, int]:
+    """
+    Execute the deploy plan, version increments are done server by server, copies are done concurrently
+    with a limited amount of workers for every filesystem.
+    Servers with staged_deploy get their software copied next to the destinations first, which is only moved into
+    the server if every copy succeeded.
+    :param plan: the deploy plan
+    :param servers: all server data (servers.json)
+    :param software_objects: Software objects of all software
+    :param progress: ProgressBar to display progress in
+    :return: (amount of copied software, amount of changed servers)
+    """
+    changed_servers = set()
+    copies: List[Tuple[str, dict]] = []
+    servers_total = len(plan)
+    for servers_iter, (server_name, server_plan) in enumerate(plan.items()):
+        context.name = server_name
+        context.failure_severity = 10
+        progress.update_message(f"Updating {server_name} [{servers_iter + 1}/{servers_total}]",
+                                ((servers_iter + 1) / servers_total) * 100)
+        server_version, changed = apply_versions(server_name, servers[server_name], server_plan, progress)
+        if changed:
+            changed_servers.add(server_name)
+        for copy in server_plan["copies"]:
+            if server_version.fulfills(VersionRangeRequirement(copy["requirements"])):
+                copies.append((server_name, copy))
+
+    config = load("data/config.json", default=CONFIG).json
+    copy_workers = max(1, config.get("copy_workers", CONFIG["copy_workers"]))
+    staged_servers = {server_name for server_name, _ in copies
+                      if servers[server_name].get("staged_deploy", config.get("staged_deploy", CONFIG["staged_deploy"]))}
+    for server_name in sorted(staged_servers):
+        try:
+            prepare(servers[server_name]["path"], [copy["destination"] for name, copy in copies if name == server_name])
+        except Exception as e:
+            cli.fail(f"Could not prepare the deployment into {server_name} - see errors.jsonl!")
+            report(9, "staged deploy - " + server_name, "Could not prepare staged deployment, the server has not been changed",
+                   exception=e, additional=f"Server: {servers[server_name]['path']}")
+            staged_servers.remove(server_name)
+            copies = [(name, copy) for name, copy in copies if name != server_name]
+    filesystems: Dict[int, BoundedSemaphore] = {}
+    for _, copy in copies:
+        filesystems.setdefault(device(copy["destination"]), BoundedSemaphore(copy_workers))
+
+    def deploy(server_name: str, copy: dict) -> bool:
+        """
+        Copy software into a server, only copy_workers copies run on the same filesystem at once
+        :param server_name: name of the server
+        :param copy: planned copy
+        :return: Weather or not the software has been copied
+        """
+        with filesystems[device(copy["destination"])]:
+            context.name = server_name
+            if server_name in staged_servers:
+                return software_objects[copy["software"]].copy(server_name, staging=staging_file(copy["destination"]))
+            return software_objects[copy["software"]].copy(server_name)
+
+    copied = 0
+    finished = 0
+    staged: Dict[str, List[dict]] = {server_name: [] for server_name in staged_servers}
+    failed_servers = set()
+    with ThreadPoolExecutor(max_workers=max(1, copy_workers * len(filesystems))) as executor:
+        futures = {executor.submit(deploy, server_name, copy): (server_name, copy) for server_name, copy in copies}
+        for future in as_completed(futures):
+            server_name, copy = futures[future]
+            finished = finished + 1
+            if not future.result():
+                failed_servers.add(server_name)
+            elif server_name in staged_servers:
+                staged[server_name].append(copy)
+            else:
+                copied = copied + 1
+                changed_servers.add(server_name)
+            progress.update_message(f"Copied software into servers [{finished}/{len(copies)}]",
+                                    done=(finished / len(copies)) * 100)
+
+    fsync_policy = config.get("fsync", CONFIG["fsync"])
+    for server_name, staged_copies in staged.items():
+        context.name = server_name
+        context.task = "committing staged deployment"
+        server_path = servers[server_name]["path"]
+        if server_name in failed_servers:
+            discard(server_path)
+            progress.fail(f"Not all software could be copied into {server_name}, the server has not been changed")
+            continue
+        try:
+            commit(server_path, [(staging_file(copy["destination"]), copy["destination"]) for copy in staged_copies],
+                   fsync_policy)
+        except Exception as e:
+            cli.fail(f"Could not commit the deployment into {server_name} - see errors.jsonl!")
+            report(9, "staged deploy - " + server_name, "Could not commit staged deployment, it will be rolled back on the next start",
+                   exception=e, additional=f"Journal: {server_path}/{JOURNAL}")
+            continue
+        for copy in staged_copies:
+            record(server_name, copy["destination"], software_objects[copy["software"]].hash)
+        copied = copied + len(staged_copies)
+        changed_servers.add(server_name)
+    return copied, len(changed_servers)
@@ -0,0 +1,46 @@
+"""
+Manifest of the software deployed into every server, so deployed files don't have to be hashed again
+"""
+from threading import Lock
+from typing import Union
+
+from singlejson import load
+
+from .sha244 import signature
+
+# {server: {destination: {hash: deployed sha224, signature: stat signature after deploying}}}
+manifest = load("data/deployments.json", default="{}")
+lock = Lock()
+
+
+def deployed_hash(server: str, destination: str) -> Union[str, None]:
+    """
+    Get the hash of the software deployed to a file if it has not been changed since
+    :param server: name of the server
+    :param destination: file in the server
+    :return: the hash or None if the file was changed or not deployed by us
+    """
+    with lock:
+        if server not in manifest.json or destination not in manifest.json[server]:
+            return None
+        entry = manifest.json[server][destination]
+    try:
+        if signature(destination) != entry["signature"]:
+            return None  # Changed manually
+    except OSError:
+        return None  # Removed
+    return entry["hash"]
+
+
+def record(server: str, destination: str, file_hash: str):
+    """
+    Save that software has been deployed to a file
+    :param server: name of the server
+    :param destination: file in the server
+    :param file_hash: hash of the deployed software
+    :return:
+    """
+    with lock:
+        if server not in manifest.json:
+            manifest.json[server] = {}
+        manifest.json[server][destination] = {"hash": file_hash, "signature": signature(destination)}
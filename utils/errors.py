@@ -3,10 +3,30 @@ The main file for handling errors
 """
 from datetime import datetime
 from json import dumps
+from os import O_APPEND, O_CREAT, O_WRONLY, write
+from os import close as close_fd, open as open_fd
+from threading import Lock
 from typing import Union
 
+from .jsonl import migrate
 from .static_info import VERSION, COMMIT
-from singlejson import JSONFile
+
+ERRORS_FILE = "data/errors.jsonl"  # One error per line, only ever appended to
+LEGACY_ERRORS_FILE = "data/errors.json"  # Array of errors, rewritten completely on every report
+lock = Lock()
+errors_fd: Union[int, None] = None
+
+
+def close():
+    """
+    Close errors.jsonl, it is opened again on the next report (e.g. after it has been archived)
+    :return:
+    """
+    global errors_fd
+    with lock:
+        if errors_fd is not None:
+            close_fd(errors_fd)
+            errors_fd = None
 
 
 def report(severity: int, sender: str, reason: str, additional: str = "",
@@ -21,8 +41,7 @@ def report(severity: int, sender: str, reason: str, additional: str = "",
     :param software: software where error was caused
     :return:
     """
-    errors = JSONFile("data/errors.json", default="[]")
-
+    global errors_fd
     time = datetime.now().strftime("%d.%m %H:%M:%S")
     stamp = datetime.now().timestamp()
 
@@ -33,26 +52,24 @@ def report(severity: int, sender: str, reason: str, additional: str = "",
     except Exception:
         exception = "Could not save exception - not serializable!"
 
+    error = {"severity": severity, "reason": reason, "from": sender}
     if software is not None:
+        error["software"] = software
+        # noinspection PyBroadException
         try:
-            from singlejson import load
+            from .state import load
             all_sources = load("data/sources.json", default="{}").json
             if software in all_sources:
-                errors.json.append({"severity": severity, "reason": reason, "from": sender, "software": software,
-                                    "last_successful_software_check": all_sources[software]["last_check"],
-                                    "additional": additional, "time": time, "stamp": stamp, "exception": str(exception),
-                                    "version": VERSION, "commit": COMMIT})
-                errors.save()
-                return
+                error["last_successful_software_check"] = all_sources[software]["last_checked"]
         except Exception as _:
-            errors.json.append({"severity": severity, "reason": reason, "from": sender, "software": software,
-                                "additional": additional, "time": time, "stamp": stamp, "exception": str(exception),
-                                "version": VERSION, "commit": COMMIT})
-            errors.save()
-            return
-
-    errors.json.append({"severity": severity, "reason": reason, "from": sender,
-                        "additional": additional, "time": time, "stamp": stamp, "exception": str(exception),
-                        "version": VERSION, "commit": COMMIT})
+            pass
+    error.update({"additional": additional, "time": time, "stamp": stamp, "exception": str(exception),
+                  "version": VERSION, "commit": COMMIT})
 
-    errors.save()
+    # A single write to a file opened with O_APPEND, lines of concurrent writers (threads and processes) don't mix
+    line = (dumps(error) + "\n").encode("utf-8")
+    with lock:
+        if errors_fd is None:
+            migrate(LEGACY_ERRORS_FILE, ERRORS_FILE)
+            errors_fd = open_fd(ERRORS_FILE, O_WRONLY | O_APPEND | O_CREAT, 0o644)
+        write(errors_fd, line)
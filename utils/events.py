@@ -1,7 +1,98 @@
 """
 The main file for handling events (positive errors ;))
+Events are buffered in memory (ring buffer) and appended to events.jsonl in batches
 """
-from singlejson import JSONFile
+import atexit
+from collections import deque
+from json import dumps
+from os import O_APPEND, O_CREAT, O_WRONLY, fsync, path, remove, replace, write
+from os import close as close_fd, open as open_fd
+from threading import Lock, Timer
+from time import time
+from typing import Deque, List, Union
+
+from singlejson import load
+
+from .file_defaults import CONFIG
+from .jsonl import migrate
+
+LEGACY_EVENTS_FILE = "data/events.json"  # Array of events, rewritten completely on every event
+config = load("data/config.json", default=CONFIG).json
+settings: dict = config.get("event_log", CONFIG["event_log"])
+lock = Lock()
+# Events that have not been written yet, the oldest events are dropped if they can't be written for too long
+buffer: Deque[dict] = deque(maxlen=max(1, settings.get("buffer_size", CONFIG["event_log"]["buffer_size"])))
+dropped = 0  # Events dropped since the last write
+last_flush = time()
+timer: Union[Timer, None] = None  # Writes the buffered events flush_interval seconds after the first one
+
+
+def files() -> List[str]:
+    """
+    Get all event files, oldest first
+    :return: rotated files and the current file
+    """
+    rotated = [f"{settings['file']}.{number}" for number in range(settings["rotations"], 0, -1)]
+    return [file for file in rotated if path.exists(file)] + [settings["file"]]
+
+
+def rotate():
+    """
+    Rotate events.jsonl if it is larger than max_size, the oldest rotated file is removed
+    :return:
+    """
+    if settings["max_size"] <= 0 or not path.exists(settings["file"]) or \
+            path.getsize(settings["file"]) < settings["max_size"] * 1000000:
+        return
+    if settings["rotations"] <= 0:
+        remove(settings["file"])  # Nothing is kept
+        return
+    for number in range(settings["rotations"] - 1, 0, -1):
+        if path.exists(f"{settings['file']}.{number}"):
+            replace(f"{settings['file']}.{number}", f"{settings['file']}.{number + 1}")
+    replace(settings["file"], settings["file"] + ".1")
+
+
+def flush():
+    """
+    Write all buffered events to disk in one write
+    :return:
+    """
+    global dropped, last_flush, timer
+    with lock:
+        last_flush = time()
+        if timer is not None:
+            timer.cancel()
+            timer = None
+        if len(buffer) == 0:
+            return
+        events = list(buffer)  # Only removed from the buffer once they have been written
+        if dropped > 0:
+            events.insert(0, {"sender": "event log", "event": f"Dropped {dropped} events, they could not be written in time",
+                              "additional": "", "stamp": time()})
+        batch = "".join(dumps(event) + "\n" for event in events).encode("utf-8")
+        migrate(LEGACY_EVENTS_FILE, settings["file"])
+        events_fd = open_fd(settings["file"], O_WRONLY | O_APPEND | O_CREAT, 0o644)
+        try:
+            write(events_fd, batch)
+            if config.get("fsync", CONFIG["fsync"]) != "never":
+                fsync(events_fd)
+        finally:
+            close_fd(events_fd)
+        buffer.clear()
+        dropped = 0
+        rotate()
+
+
+def flush_later():
+    """
+    Write the buffered events from the timer, they stay buffered if they can't be written (retried with the next event)
+    :return:
+    """
+    try:
+        flush()
+    except OSError:
+        pass
 
 
 def report(sender: str, event: str, additional: str = ""):
@@ -12,7 +103,19 @@ def report(sender: str, event: str, additional: str = ""):
     :param additional: additional information
     :return:
     """
-    events = JSONFile("data/events.json", default="[]")
+    global dropped, timer
+    with lock:
+        if len(buffer) == buffer.maxlen:
+            dropped = dropped + 1  # The oldest event is pushed out
+        buffer.append({"sender": sender, "event": event, "additional": additional, "stamp": time()})
+        full = len(buffer) >= settings["batch_size"] or time() - last_flush >= settings["flush_interval"]
+        if not full and timer is None:
+            # Also written if no other events follow (e.g. while watching for changes)
+            timer = Timer(settings["flush_interval"], flush_later)
+            timer.daemon = True
+            timer.start()
+    if full:
+        flush()
+
 
-    events.json.append({"sender": sender, "event": event, "additional": additional})
-    events.save()
+atexit.register(flush)  # Also written if the program crashes
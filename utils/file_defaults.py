@@ -14,6 +14,55 @@ CONFIG = {
     "sources_folder": "software",
     "version_check_interval": 3,
     "debug": False,
+    "check_workers": 8,
+    "connections_per_host": 4,
+    "pooled_hosts": 32,
+    "rate_limits": {},
+    "max_retries": 3,
+    "fsync": "file",
+    "deploy_mode": "copy",
+    "copy_workers": 2,
+    "staged_deploy": False,
+    "watch_debounce": 0.5,
+    "segmented_downloads": {
+        "enabled": True,
+        "segments": 4,
+        "min_size": 8
+    },
+    "response_cache": {
+        "enabled": True,
+        "folder": "data/cache",
+        "max_age": 0,
+        "max_size": 64
+    },
+    "hash_buffer": 1024,
+    "hash_workers": 4,
+    "hash_cache": {
+        "enabled": True,
+        "file": "data/hash_cache.json",
+        "verify_interval": 7
+    },
+    "state_store": {
+        "backend": "json",
+        "database": "data/state.db"
+    },
+    "event_log": {
+        "file": "data/events.jsonl",
+        "batch_size": 50,
+        "buffer_size": 1000,
+        "flush_interval": 10,
+        "max_size": 10,
+        "rotations": 3
+    },
+    "jar_metadata": {
+        "enabled": True,
+        "file": "data/jar_metadata.json"
+    },
+    "artifact_store": {
+        "enabled": True,
+        "folder": "data/artifacts",
+        "max_size": 512
+    },
     "default_headers": {
         "User-Agent": "minecraft-plugin-downloader (github/qrashi/...) - automated service"
     },
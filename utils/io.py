@@ -1,9 +1,24 @@
 """
 Basic IO operations
 """
-from os import path, stat, makedirs
+from errno import EXDEV
+from os import O_RDONLY, close, fstat, fsync, link, path, remove, replace, makedirs
+from os import open as open_fd
+from shutil import copy, copymode, copyfileobj
 from typing import TextIO
 
+# Reflinks are only available on linux (btrfs, xfs, ...)
+try:
+    from fcntl import ioctl
+except ImportError:
+    ioctl = None
+try:
+    from os import copy_file_range
+except ImportError:
+    copy_file_range = None
+
+FICLONE = 0x40049409  # ioctl to share all data blocks of a file (linux/fs.h)
+
 
 def abs_filename(file: str) -> str:
     """
@@ -14,19 +29,119 @@ def abs_filename(file: str) -> str:
     return path.abspath(file)
 
 
-def generate(file: str, default: str = "{}") -> bool:
+def replace_file(source: str, destination: str, fsync_policy: str = "file"):
+    """
+    Atomically replace a file with another one, readers see either the old or the new file
+    Files on different filesystems are copied next to the destination first.
+    :param source: file to move (removed afterwards)
+    :param destination: file to replace
+    :param fsync_policy: "never", "file" (flush the file to disk before replacing) or "full" (also flush the directory)
+    :return:
+    """
+    if fsync_policy != "never":
+        with open(source, "rb") as file:  # Read only, builds may be read-only (copy keeps the mode)
+            fsync(file.fileno())
+    try:
+        replace(source, destination)
+    except OSError as e:
+        if e.errno != EXDEV:
+            raise
+        try:
+            copy(source, destination + ".part")
+            if fsync_policy != "never":
+                with open(destination + ".part", "rb") as file:
+                    fsync(file.fileno())
+            replace(destination + ".part", destination)
+        except OSError:
+            if path.exists(destination + ".part"):
+                remove(destination + ".part")
+            raise
+        remove(source)
+    if fsync_policy == "full":
+        sync_directory(path.dirname(path.abspath(destination)))
+
+
+def sync_directory(directory: str):
+    """
+    Flush a directory to disk, so renames in it are durable
+    :param directory: the directory
+    :return:
+    """
+    try:
+        directory_fd = open_fd(directory, O_RDONLY)
+    except OSError:
+        return  # Directories can't be opened on every platform (windows)
+    try:
+        fsync(directory_fd)
+    finally:
+        close(directory_fd)
+
+
+def clone_file(source: str, destination: str):
+    """
+    Copy a file sharing its data blocks with the source if the filesystem supports it (reflink).
+    Falls back to copy_file_range (copies inside the kernel, some filesystems share blocks as well) and a normal copy.
+    :param source: file to copy
+    :param destination: new file
+    :return:
+    """
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        if ioctl is not None:
+            try:
+                ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+                copymode(source, destination)
+                return
+            except OSError:
+                pass  # Not supported by the filesystem
+        if copy_file_range is not None:
+            try:
+                remaining = fstat(source_file.fileno()).st_size
+                while remaining > 0:
+                    copied = copy_file_range(source_file.fileno(), destination_file.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining = remaining - copied
+                copymode(source, destination)
+                return
+            except OSError:
+                source_file.seek(0)
+                destination_file.seek(0)
+                destination_file.truncate()
+        copyfileobj(source_file, destination_file)
+    copymode(source, destination)
+
+
+def deploy_file(source: str, destination: str, mode: str = "copy", fsync_policy: str = "file"):
     """
-    check a file and generate if it doesn't exist
-    :param file: file to generate
-    :param default: default to write to file
-    :return: weather or not file has existed (will now exist)
+    Put a file into a server, the destination is replaced atomically and never written in place,
+    so hard links / reflinks to the previous file are never changed
+    :param source: file to deploy
+    :param destination: file in the server
+    :param mode: "copy", "reflink" (share the data blocks, copy if not supported) or "hardlink" (copy if not supported)
+    :param fsync_policy: see replace_file
+    :return:
     """
-    if path.exists(file):
-        if not stat(file).st_size < len(default.encode('utf-8')):
-            return True
-    else:
-        makedirs(path.dirname(file), exist_ok=True)
-    file = open(file, "w+")
-    file.write(default)
-    file.close()
-    return False
+    if path.exists(destination) and path.samefile(source, destination):
+        return  # Already linked
+    makedirs(path.dirname(path.abspath(destination)), exist_ok=True)
+    temporary = destination + ".tmp"
+    if path.exists(temporary):
+        remove(temporary)
+    try:
+        if mode == "hardlink":
+            try:
+                link(source, temporary)
+                replace_file(temporary, destination, "never")  # Nothing new to flush
+                return
+            except OSError:
+                if path.exists(temporary):
+                    remove(temporary)  # Different filesystem or no support for links, copy instead
+        if mode == "reflink":
+            clone_file(source, temporary)
+        else:
+            copy(source, temporary)
+        replace_file(temporary, destination, fsync_policy)
+    except OSError:
+        if path.exists(temporary):
+            remove(temporary)  # Don't leave half deployed files in the server
+        raise
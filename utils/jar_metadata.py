@@ -0,0 +1,110 @@
+"""
+Read the metadata (plugin.yml / paper-plugin.yml) plugins declare in their jar
+"""
+import re
+from threading import Lock
+from typing import Dict, List, Union
+from zipfile import BadZipFile, ZipFile
+
+from singlejson import load
+
+from .file_defaults import CONFIG
+from .sha244 import get_hash
+
+METADATA_FILES = ["paper-plugin.yml", "plugin.yml"]  # paper-plugin.yml is preferred by paper
+settings: dict = load("data/config.json", default=CONFIG).json.get("jar_metadata", CONFIG["jar_metadata"])
+# {sha224 of the jar: metadata}, jars without (readable) metadata are not remembered, they might be repaired
+index = load(settings["file"], default="{}")
+index_lock = Lock()
+SHA224 = re.compile("[0-9a-f]{56}")  # get_hash returns an error message if the file could not be hashed
+
+
+def parse_value(value: str) -> Union[str, List[str]]:
+    """
+    Parse a simple YAML value (scalar or flow list)
+    :param value: the value
+    :return: string or list of strings
+    """
+    value = value.split(" #")[0].strip()
+    if value.startswith("[") and value.endswith("]"):
+        return [parse_value(item) for item in value[1:-1].split(",") if item.strip() != ""]
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1]
+    return value
+
+
+def parse_metadata(text: str) -> Dict[str, Union[str, List[str]]]:
+    """
+    Parse the top level keys of a plugin.yml, nested sections (commands, permissions, ...) are skipped
+    :param text: content of the file
+    :return: {key: value}
+    """
+    metadata = {}
+    key = None
+    for line in text.splitlines():
+        if line.strip() == "" or line.lstrip().startswith("#"):
+            continue
+        if not line[0].isspace() and ":" in line:
+            key, value = line.split(":", 1)
+            key = key.strip()
+            value = parse_value(value)
+            metadata[key] = value if value != "" else []
+        elif key is not None and line.strip().startswith("- ") and isinstance(metadata[key], list):
+            metadata[key].append(parse_value(line.strip()[2:]))
+        else:
+            key = None  # Nested section
+    return metadata
+
+
+def read_metadata(filename: str) -> Union[Dict[str, Union[str, List[str]]], None]:
+    """
+    Read the metadata of a jar, only the central directory and the metadata entry are read
+    :param filename: the jar
+    :return: {name, version, api-version, depend, softdepend} (if declared) or None if there is no metadata
+    """
+    try:
+        with ZipFile(filename) as jar:
+            names = set(jar.namelist())
+            for metadata_file in METADATA_FILES:
+                if metadata_file in names:
+                    metadata = parse_metadata(jar.read(metadata_file).decode("utf-8", errors="replace"))
+                    break
+            else:
+                return None
+    except (BadZipFile, OSError):
+        return None
+    return {key: metadata[key] for key in ["name", "version", "api-version", "depend", "softdepend"]
+            if key in metadata}
+
+
+def metadata(filename: str, file_hash: Union[str, None] = None) -> Union[Dict[str, Union[str, List[str]]], None]:
+    """
+    Get the metadata of a jar, jars are only read once for every hash
+    :param filename: the jar
+    :param file_hash: sha224 of the jar if it is already known
+    :return: see read_metadata
+    """
+    file_hash = file_hash if file_hash is not None or not settings["enabled"] else get_hash(filename)
+    if not settings["enabled"] or SHA224.fullmatch(file_hash) is None:
+        return read_metadata(filename)
+    with index_lock:
+        if index.json.get(file_hash) is not None:
+            return index.json[file_hash]
+    jar_metadata = read_metadata(filename)
+    if jar_metadata is not None:
+        with index_lock:
+            index.json[file_hash] = jar_metadata
+    return jar_metadata
+
+
+def api_version(filename: str, file_hash: Union[str, None] = None) -> Union[str, None]:
+    """
+    Get the lowest game version a plugin declares to support
+    :param filename: the jar
+    :param file_hash: sha224 of the jar if it is already known
+    :return: the api-version or None
+    """
+    jar_metadata = metadata(filename, file_hash)
+    if jar_metadata is None or not isinstance(jar_metadata.get("api-version"), str):
+        return None
+    return jar_metadata["api-version"]
@@ -0,0 +1,182 @@
+"""
+Extract only the needed parts of big JSON responses
+"""
+from json import dumps
+from typing import Any, List, Union
+
+# ijson (requirements.txt) parses responses while downloading. Without it, or for paths with list indexes,
+# the whole response is parsed and only the needed parts are kept
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+class Projection:
+    """
+    The part of a JSON document a WebAccessField task needs:
+    the subtree at path, or if fields are given, only these fields of every element of the list at path
+    """
+
+    def __init__(self, path: List[Union[str, int]], fields: Union[List[List[Union[str, int]]], None] = None):
+        """
+        Initialize the projection
+        :param path: URIAccessField to the needed subtree
+        :param fields: URIAccessFields relative to the elements of the list at path, None to keep the whole subtree
+        """
+        self.path = path
+        self.fields = fields
+
+    def key(self) -> str:
+        """
+        Get a key to cache the projected data with
+        :return: the key (str)
+        """
+        return dumps([self.path, self.fields])
+
+    def streamable(self) -> bool:
+        """
+        Check if the projection can be extracted while parsing.
+        ijson can't index lists, so the path may only contain keys.
+        :return: Weather or not the response can be streamed
+        """
+        return ijson is not None and all(type(key) is str and "." not in key for key in self.path)
+
+    def extract(self, response) -> dict:
+        """
+        Extract the projection from a response, the response is closed afterwards (also if it has not been read completely)
+        :param response: the response (requested with stream=True)
+        :return: the extracted data, {"found": bool, "value": data, "projected": bool} (JSON serializable)
+        """
+        with response:
+            return self.extract_response(response)
+
+    def extract_response(self, response) -> dict:
+        """
+        Extract the projection from a response without closing it
+        :param response: the response (requested with stream=True)
+        :return: the extracted data, see extract
+        """
+        if not self.streamable():
+            found, value = walk(response.json(), self.path)
+            if found and self.fields is not None:
+                if type(value) is not list:
+                    return {"found": True, "value": value, "projected": False}
+                value = [self.project_element(element) for element in value]
+            return {"found": found, "value": value, "projected": found and self.fields is not None}
+        response.raw.decode_content = True
+        if self.fields is None:
+            for value in ijson.items(response.raw, ".".join(self.path), use_float=True):
+                return {"found": True, "value": value, "projected": False}
+            return {"found": False, "value": None, "projected": False}
+        return self.extract_elements(ijson.parse(response.raw, use_float=True))
+
+    def extract_elements(self, events) -> dict:
+        """
+        Extract the fields of the list elements from ijson events, only one element is built at a time
+        :param events: ijson parser events
+        :return: the extracted data, see extract
+        """
+        prefix = ".".join(self.path)
+        builder = None
+        depth = 0
+        elements = []
+        found = False
+        for event_prefix, event, value in events:
+            if not found:
+                if event_prefix == prefix and event not in ("map_key", "end_map", "end_array"):
+                    if event != "start_array":
+                        return {"found": True, "value": None, "projected": False}  # Not a list
+                    found = True
+                continue
+            if builder is None:
+                if event_prefix == prefix and event == "end_array":
+                    break
+                if event not in ("start_map", "start_array"):
+                    elements.append(self.project_element(value))
+                    continue
+                builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            if event in ("start_map", "start_array"):
+                depth = depth + 1
+            elif event in ("end_map", "end_array"):
+                depth = depth - 1
+            if depth == 0:
+                elements.append(self.project_element(builder.value))
+                builder = None
+        return {"found": found, "value": elements, "projected": found}
+
+    def project_element(self, element) -> List[List]:
+        """
+        Keep only the fields of a list element
+        :param element: list element
+        :return: [[found, value] for every field]
+        """
+        return [list(walk(element, field)) for field in self.fields]
+
+    def rebuild(self, extracted: dict) -> Any:
+        """
+        Rebuild a document with the same structure as the original, so the task can access it normally
+        :param extracted: data returned by extract
+        :return: the (partial) document
+        """
+        if not extracted["found"]:
+            return {}  # Accessing the path fails like it would have in the original document
+        value = extracted["value"]
+        if extracted["projected"]:
+            elements = []
+            for fields in value:
+                element = {}
+                for field, (found, field_value) in zip(self.fields, fields):
+                    if not found:
+                        continue
+                    nested = nest(field, field_value)
+                    if type(element) is dict and type(nested) is dict:
+                        merge(element, nested)
+                    else:
+                        element = nested
+                elements.append(element)
+            value = elements
+        return nest(self.path, value)
+
+
+def walk(data, path: List[Union[str, int]]) -> tuple:
+    """
+    Access a field of a document without reporting errors
+    :param data: the document
+    :param path: URIAccessField to the field
+    :return: (found, value)
+    """
+    for key in path:
+        try:
+            data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return False, None
+    return True, data
+
+
+def nest(path: List[Union[str, int]], value) -> Any:
+    """
+    Put a value into nested dicts, so that it can be accessed using the path
+    (list indices become dict keys, uri_access works the same way)
+    :param path: URIAccessField
+    :param value: the value
+    :return: the nested value
+    """
+    for key in reversed(path):
+        value = {key: value}
+    return value
+
+
+def merge(into: dict, other: dict):
+    """
+    Merge nested dicts
+    :param into: dict to merge into
+    :param other: dict to merge
+    :return:
+    """
+    for key, value in other.items():
+        if key in into and type(into[key]) is dict and type(value) is dict:
+            merge(into[key], value)
+        else:
+            into[key] = value
@@ -0,0 +1,59 @@
+"""
+Files with one JSON object per line (errors.jsonl, events.jsonl), they are only ever appended to
+"""
+import json
+from os import path, remove, replace
+from typing import Iterator
+
+
+def migrate(legacy_file: str, filename: str):
+    """
+    Convert a JSON array from older versions into a JSON lines file (entries of the array first)
+    :param legacy_file: file with the JSON array
+    :param filename: JSON lines file
+    :return:
+    """
+    if not path.exists(legacy_file):
+        return
+    with open(legacy_file, "r") as legacy:
+        try:
+            legacy_entries = json.load(legacy)
+        except ValueError:
+            legacy_entries = []
+    with open(filename + ".tmp", "w") as new_file:
+        for entry in legacy_entries:
+            new_file.write(json.dumps(entry) + "\n")
+        if path.exists(filename):
+            with open(filename, "r") as entries:
+                for line in entries:
+                    new_file.write(line)
+    replace(filename + ".tmp", filename)
+    remove(legacy_file)
+
+
+def read(filename: str) -> Iterator[dict]:
+    """
+    Read the entries one after another without loading the whole file
+    :param filename: file to read
+    :return: iterator of entries
+    """
+    if not path.exists(filename):
+        return
+    with open(filename, "r") as entries:
+        for line in entries:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # Incomplete line (crash while writing)
+
+
+def count(filename: str) -> int:
+    """
+    Count the entries in a file without parsing them
+    :param filename: file to count
+    :return: amount of entries
+    """
+    if not path.exists(filename):
+        return 0
+    with open(filename, "rb") as entries:
+        return sum(1 for line in entries if line.strip() != b"")
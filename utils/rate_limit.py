@@ -0,0 +1,153 @@
+"""
+Per host rate limits for web requests
+"""
+from email.utils import parsedate_to_datetime
+from threading import BoundedSemaphore, Lock
+from time import monotonic, sleep, time
+from typing import Dict, Union
+from urllib.parse import urlparse
+
+from singlejson import load
+
+from .file_defaults import CONFIG
+
+config = load("data/config.json", default=CONFIG).json
+limiters: Dict[str, "RateLimiter"] = {}
+limiters_lock = Lock()
+
+
+class RateLimiter:
+    """
+    A token bucket for a single host, adapts to the limits the host tells us about
+    """
+
+    def __init__(self, requests_per_second: Union[float, None], burst: int):
+        """
+        Initialize the rate limiter
+        :param requests_per_second: configured rate, None if the host has no configured limit
+        :param burst: amount of requests that can be made at once
+        """
+        self.rate = requests_per_second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.blocked_until = 0.0  # No requests before this time (Retry-After)
+        self.remaining: Union[float, None] = None  # Requests left until the reset announced by X-RateLimit-* headers
+        self.reset_at = 0.0
+        self.waited = 0.0  # Total time requests were delayed
+        self.lock = Lock()
+
+    def wait(self, slot: Union[BoundedSemaphore, None] = None) -> float:
+        """
+        Wait until a request can be made.
+        Every request reserves a token, so waiting requests are scheduled at the full allowed rate.
+        :param slot: connection slot of the host held by the caller, it is free for other requests while waiting
+        :return: time waited (seconds)
+        """
+        with self.lock:
+            now = monotonic()
+            delay = max(0.0, self.blocked_until - now)
+            if self.rate is not None:
+                self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+                self.tokens = self.tokens - 1
+                if self.tokens < 0:
+                    delay = max(delay, -self.tokens / self.rate)
+            if self.remaining is not None and now < self.reset_at:
+                self.remaining = self.remaining - 1
+                if self.remaining < 0:
+                    delay = max(delay, self.reset_at - now)  # Used up all requests the server allows
+            self.updated = now
+            self.waited = self.waited + delay
+        if delay > 0:
+            if slot is not None:
+                slot.release()
+            try:
+                sleep(delay)
+            finally:
+                if slot is not None:
+                    slot.acquire()
+        return delay
+
+    def block(self, seconds: float):
+        """
+        Don't make any requests for some time
+        :param seconds: time to wait
+        :return:
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, monotonic() + seconds)
+
+    def update(self, headers) -> Union[float, None]:
+        """
+        Adapt to the rate limit headers of a response
+        :param headers: response headers
+        :return: the time the server asked us to wait (Retry-After), None if it did not ask
+        """
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        if retry_after is not None:
+            self.block(retry_after)
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = parse_reset(headers.get("X-RateLimit-Reset"))
+        if remaining is None or not remaining.isdigit() or reset is None:
+            return retry_after
+        with self.lock:
+            self.remaining = float(remaining)
+            self.reset_at = monotonic() + reset
+        return retry_after
+
+
+def parse_retry_after(value: Union[str, None]) -> Union[float, None]:
+    """
+    Parse a Retry-After header
+    :param value: header value (seconds or HTTP date)
+    :return: seconds to wait or None
+    """
+    if value is None:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_reset(value: Union[str, None]) -> Union[float, None]:
+    """
+    Parse a X-RateLimit-Reset header, some APIs send a timestamp and some the seconds until the reset
+    :param value: header value
+    :return: seconds until the reset or None
+    """
+    try:
+        reset = float(value)
+    except (TypeError, ValueError):
+        return None
+    if reset > 1000000000:  # Timestamp
+        return max(0.0, reset - time())
+    return reset
+
+
+def limiter(url: str) -> RateLimiter:
+    """
+    Get the rate limiter for the host of an url
+    :param url: URL that is going to be requested
+    :return: the rate limiter
+    """
+    host = urlparse(url).netloc
+    with limiters_lock:
+        if host not in limiters:
+            limits = config.get("rate_limits", CONFIG["rate_limits"])
+            if host in limits:
+                limiters[host] = RateLimiter(limits[host]["requests_per_second"], limits[host]["burst"])
+            else:
+                limiters[host] = RateLimiter(None, 1)
+        return limiters[host]
+
+
+def waiting_times() -> Dict[str, float]:
+    """
+    Get the time requests to every host were delayed by rate limits
+    :return: {host: seconds}
+    """
+    with limiters_lock:
+        return {host: host_limiter.waited for host, host_limiter in limiters.items()}
@@ -0,0 +1,148 @@
+"""
+Persistent cache for web responses, revalidated using ETag / Last-Modified
+"""
+from hashlib import sha224
+from json import dumps
+from os import makedirs, remove
+from threading import Lock
+from time import time
+from typing import Dict, Union
+
+from singlejson import load
+
+from .file_defaults import CONFIG
+
+config = load("data/config.json", default=CONFIG).json
+settings: dict = config.get("response_cache", CONFIG["response_cache"])
+CACHE_DIR = settings["folder"]
+index = load(CACHE_DIR + "/index.json", default="{}")
+lock = Lock()
+
+
+def cache_key(url: str, headers) -> str:
+    """
+    Get the key of a request, responses depend on the url and the headers used
+    :param url: requested URL
+    :param headers: headers used for the request (and anything else the cached data depends on)
+    :return: the key (str)
+    """
+    return sha224(dumps([url, headers], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def body_file(key: str) -> str:
+    """
+    Get the file a response body is stored in
+    :param key: key of the response
+    :return: the filename
+    """
+    return CACHE_DIR + "/" + key + ".body"
+
+
+def lookup(key: str) -> Union[Dict, None]:
+    """
+    Look up a cached response
+    :param key: key of the response
+    :return: the cache entry or None if there is no usable entry
+    """
+    if not settings["enabled"]:
+        return None
+    with lock:
+        if key not in index.json:
+            return None
+        return index.json[key]
+
+
+def is_fresh(entry: Dict, max_age: Union[int, None]) -> bool:
+    """
+    Check if a cached response can be used without asking the server
+    :param entry: the cache entry
+    :param max_age: time (seconds) a response can be used without revalidation, None for the configured default
+    :return: Weather or not the response is fresh
+    """
+    if max_age is None:
+        max_age = settings["max_age"]
+    return time() - entry["stored"] < max_age
+
+
+def validators(entry: Dict) -> Dict[str, str]:
+    """
+    Get the headers to revalidate a cached response with
+    :param entry: the cache entry
+    :return: headers for a conditional request
+    """
+    headers = {}
+    if entry["etag"] is not None:
+        headers["If-None-Match"] = entry["etag"]
+    if entry["last_modified"] is not None:
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def read(key: str) -> Union[bytes, None]:
+    """
+    Read a cached response body
+    :param key: key of the response
+    :return: The body or None if it could not be read
+    """
+    try:
+        with open(body_file(key), "rb") as file:
+            body = file.read()
+    except OSError:
+        return None
+    with lock:
+        if key in index.json:
+            index.json[key]["used"] = time()
+    return body
+
+
+def revalidated(key: str):
+    """
+    Mark a cached response as fresh after the server confirmed that it is still valid (304)
+    :param key: key of the response
+    :return:
+    """
+    with lock:
+        if key in index.json:
+            index.json[key]["stored"] = time()
+
+
+def store(key: str, url: str, response, body: Union[bytes, None] = None):
+    """
+    Store a response, evict old responses if the cache is too big
+    :param key: key of the response
+    :param url: requested URL
+    :param response: the response (status code 200)
+    :param body: body to store instead of the response content
+    :return:
+    """
+    if not settings["enabled"]:
+        return
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if body is None:
+        body = response.content
+    with lock:
+        makedirs(CACHE_DIR, exist_ok=True)
+        with open(body_file(key), "wb") as file:
+            file.write(body)
+        index.json[key] = {"url": url, "etag": etag, "last_modified": last_modified, "stored": time(),
+                           "used": time(), "size": len(body)}
+        evict()
+        index.save()
+
+
+def evict():
+    """
+    Remove the least recently used responses until the cache fits into the configured size, the lock has to be held
+    :return:
+    """
+    max_size = settings["max_size"] * 1024 * 1024
+    total = sum(entry["size"] for entry in index.json.values())
+    for key in sorted(index.json, key=lambda cached: index.json[cached]["used"]):
+        if total <= max_size:
+            return
+        total = total - index.json.pop(key)["size"]
+        try:
+            remove(body_file(key))
+        except OSError:
+            pass  # Already gone
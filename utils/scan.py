@@ -0,0 +1,51 @@
+"""
+Scan the software folder for added, removed and changed files
+"""
+import os
+from typing import Dict, List
+
+from .sha244 import cached_hash, get_hashes, stat_signature
+
+
+def entry_signature(entry: os.DirEntry) -> List[int]:
+    """
+    Get the stat signature of a directory entry (see sha244.signature) without looking the file up again
+    :param entry: the entry
+    :return: see sha244.stat_signature
+    """
+    return stat_signature(entry.stat())
+
+
+def scan(folder: str, known_files: Dict[str, str]) -> Dict[str, str]:
+    """
+    Compare the files in a folder with the known software files.
+    Only files whose stat signature changed since they were last hashed are hashed again (all at once).
+    :param folder: folder to scan
+    :param known_files: {file name: hash}
+    :return: {file name: "added" / "removed" / "changed"}
+    """
+    detected_files = {}
+    files = set()
+    candidates = {}
+    with os.scandir(folder) as directory:
+        for entry in directory:
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                continue
+            files.add(entry.name)
+            if entry.name not in known_files:
+                detected_files[entry.name] = "added"
+                continue
+            file_hash = cached_hash(entry.path, entry_signature(entry))
+            if file_hash is None:
+                candidates[entry.path] = entry.name  # Moved since it was hashed
+            elif file_hash != known_files[entry.name]:
+                detected_files[entry.name] = "changed"
+
+    for filename, file_hash in get_hashes(list(candidates)).items():
+        if file_hash != known_files[candidates[filename]]:
+            detected_files[candidates[filename]] = "changed"
+
+    for file in known_files:
+        if file not in files:
+            detected_files[file] = "removed"
+    return detected_files
@@ -1,16 +1,116 @@
 """
 Hashing utilities
 """
-from hashlib import sha224
-from os import path
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import new, sha224
+from os import path, stat
+from threading import Lock
+from time import time
+from typing import Dict, List, Tuple, Union
+
+from singlejson import load
 
 from .errors import report
 from .context_manager import context
+from .file_defaults import CONFIG
+
+config = load("data/config.json", default=CONFIG).json
+settings: dict = config.get("hash_cache", CONFIG["hash_cache"])
+# files: {absolute path: {signature: stat signature, hash: sha224}}, verified: timestamp of the last full verification
+cache = load(settings["file"], default='{"files": {}, "verified": 0}')
+cache_lock = Lock()
+statistics = {"hits": 0, "misses": 0}
+if settings["verify_interval"] > 0 and time() - cache.json["verified"] > settings["verify_interval"] * 86400:
+    # Full verification, every file is hashed again
+    cache.json["files"] = {}
+    cache.json["verified"] = time()
+
+
+def stat_signature(file_stat) -> List[int]:
+    """
+    Get the stat signature of a stat result. The ctime of hard linked files (deploy_mode "hardlink") is left out,
+    it changes whenever a link is added or removed, which would invalidate the signatures of all other links.
+    :param file_stat: result of stat()
+    :return: [device, inode, size, mtime_ns, ctime_ns (0 for hard linked files)]
+    """
+    ctime = file_stat.st_ctime_ns if file_stat.st_nlink <= 1 else 0
+    return [file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns, ctime]
+
+
+def signature(filename: str) -> List[int]:
+    """
+    Get the stat signature of a file, the file is assumed to be unchanged as long as its signature is the same
+    :param filename: the file
+    :return: see stat_signature
+    """
+    return stat_signature(stat(filename))
+
+
+def remember_hash(filename: str, file_hash: str, file_signature: List[int]):
+    """
+    Save the hash of a file in the hash cache
+    :param filename: the file
+    :param file_hash: sha224 hash of the file
+    :param file_signature: stat signature of the file before it was hashed
+    :return:
+    """
+    if not settings["enabled"] or signature(filename) != file_signature:
+        return  # Changed while hashing
+    if time() - file_signature[3] / 1000000000 < 2:
+        return  # Modified just now, changes within the timestamp resolution would go unnoticed
+    with cache_lock:
+        cache.json["files"][path.abspath(filename)] = {"signature": file_signature, "hash": file_hash}
+
+
+def cached_hash(filename: str, file_signature: List[int]) -> Union[str, None]:
+    """
+    Get the hash of a file from the hash cache
+    :param filename: the file
+    :param file_signature: current stat signature of the file
+    :return: the hash or None if the file changed since it was hashed
+    """
+    if not settings["enabled"]:
+        return None
+    with cache_lock:
+        entry = cache.json["files"].get(path.abspath(filename))
+        if entry is not None and entry["signature"] == file_signature:
+            statistics["hits"] = statistics["hits"] + 1
+            return entry["hash"]
+        statistics["misses"] = statistics["misses"] + 1
+    return None
+
+
+def hash_statistics() -> Tuple[int, int]:
+    """
+    Get statistics of the hash cache
+    :return: (hits, misses)
+    """
+    with cache_lock:
+        return statistics["hits"], statistics["misses"]
+
+
+def hash_stream(file, hashes: list):
+    """
+    Feed the rest of an open file into hashes, using a fixed size buffer
+    :param file: file opened in binary mode (unbuffered works best)
+    :param hashes: hashlib hashes to update
+    :return: amount of bytes hashed
+    """
+    buffer = bytearray(max(1, config.get("hash_buffer", CONFIG["hash_buffer"])) * 1024)
+    view = memoryview(buffer)
+    hashed = 0
+    read = file.readinto(buffer)
+    while read:
+        for file_hash in hashes:
+            file_hash.update(view[:read])
+        hashed = hashed + read
+        read = file.readinto(buffer)
+    return hashed
 
 
 def get_hash(filename: str) -> str:
     """
-    Get the hash of a file
+    Get the hash of a file, files are only hashed again if their stat signature changed
     :param filename: file to get hash of
     :return: hash (str)
     """
@@ -19,11 +119,73 @@ def get_hash(filename: str) -> str:
                f"File to get hash of does not exist. - updating {context.name}", additional="File: " + filename)
         return "invalid file!"
     try:
-        with open(filename, "rb") as file:
-            file_bytes = file.read()
-            return sha224(file_bytes).hexdigest()
+        file_signature = signature(filename)
+        file_hash = cached_hash(filename, file_signature)
+        if file_hash is not None:
+            return file_hash
+        file_hash = sha224()
+        with open(filename, "rb", buffering=0) as file:
+            hash_stream(file, [file_hash])
+        file_hash = file_hash.hexdigest()
+        remember_hash(filename, file_hash, file_signature)
+        return file_hash
     except Exception as e:
         report(int(context.failure_severity / 4), "Hashing utility",
                f"There was an error while trying to get the hash for a file. This will cause all plugins to get copied constantly resulting in higher copy times. This error is not critical. {context.name}",
                additional="File: " + filename, exception=e)
         return "Exception while hashing"
+
+
+def get_hashes(filenames: List[str]) -> Dict[str, str]:
+    """
+    Hash many files at once, hashlib releases the GIL so files are hashed in parallel
+    :param filenames: files to get the hashes of
+    :return: {filename: hash}
+    """
+    filenames = list(dict.fromkeys(filenames))
+    with ThreadPoolExecutor(max_workers=max(1, config.get("hash_workers", CONFIG["hash_workers"]))) as executor:
+        return dict(zip(filenames, executor.map(get_hash, filenames)))
+
+
+class DownloadHash:
+    """
+    Hash of a file that is being downloaded, data is hashed while it is written so the file does not have to be read again
+    """
+
+    def __init__(self, checksum_algorithm: Union[str, None] = None):
+        """
+        Initialize the hash
+        :param checksum_algorithm: hashlib name of the algorithm of an upstream checksum to compute as well, None for no checksum
+        """
+        self.hashes = [sha224()]
+        if checksum_algorithm is not None:
+            self.hashes.append(new(checksum_algorithm))
+        self.position = 0  # Everything before this byte has been hashed
+        self.lock = Lock()
+
+    def update(self, offset: int, data: bytes) -> bool:
+        """
+        Hash data written to the file, only data directly following the hashed part can be hashed
+        :param offset: position of the data in the file
+        :param data: the written data
+        :return: Weather or not the data has been hashed
+        """
+        with self.lock:
+            if offset != self.position:
+                return False
+            for file_hash in self.hashes:
+                file_hash.update(data)
+            self.position = self.position + len(data)
+            return True
+
+    def finish(self, filename: str) -> Tuple[str, Union[str, None]]:
+        """
+        Hash the rest of the file (parts that were downloaded out of order or before the download was resumed)
+        :param filename: the downloaded file
+        :return: (sha224 hash, checksum or None)
+        """
+        with self.lock:
+            with open(filename, "rb", buffering=0) as file:
+                file.seek(self.position)
+                self.position = self.position + hash_stream(file, self.hashes)
+            return self.hashes[0].hexdigest(), self.hashes[1].hexdigest() if len(self.hashes) > 1 else None
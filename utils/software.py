@@ -2,17 +2,18 @@
 Software management tools
 """
 from os import stat
+from typing import Union
 
 from utils.file_defaults import CONFIG
 import utils.cli as cli
+from .deployments import record
 from .dict_utils import enabled
 from .errors import report
-from singlejson import load
-from .io import generate
+from .state import load
+from .io import deploy_file
 from .sha244 import get_hash
 from .source import Source
 
-from shutil import copy
 from .versions import VersionRangeRequirement
 from .context_manager import context
 
@@ -56,12 +57,14 @@ class Software:
         """
         return get_hash(self.file)
 
-    def needs_update(self, other: str) -> bool:
+    def needs_update(self, other: str, other_hash: Union[str, None] = None) -> bool:
         """
         Checks if the remote file hash is equal to the current hash
+        :param other: the file in the server
+        :param other_hash: hash of the file in the server if it is already known
         :return bool: If there has been a file change
         """
-        return self.hash != get_hash(other)
+        return self.hash != (other_hash if other_hash is not None else get_hash(other))
 
     def retrieve_newest(self, check: bool, force_retrieve: bool, software_data) -> bool:
         """
@@ -75,7 +78,10 @@ class Software:
         context.name = self.name
         if self.has_source():
             updated = self.source.update(check, force_retrieve)
-            self.hash = self.get_hash()
+            if updated and self.source.downloaded_hash is not None:
+                self.hash = self.source.downloaded_hash  # Hashed while downloading
+            else:
+                self.hash = self.get_hash()
             self.requirements = VersionRangeRequirement(software_data["requirements"])
             return updated
         new_hash = self.get_hash()
@@ -86,10 +92,18 @@ class Software:
         self.hash = new_hash
         return False
 
-    def copy(self, server: str) -> bool:
+    def refreshed(self) -> bool:
+        """
+        Check if the source refreshed results it served from the last run and they changed
+        :return: Weather or not retrieve_newest should be repeated
+        """
+        return self.has_source() and self.source.refreshed()
+
+    def copy(self, server: str, staging: Union[str, None] = None) -> bool:
         """
         Copies dependency into the server if possible.
         :param server: Name of the server
+        :param staging: File to copy to instead, it is moved into the server when the staged deployment is committed
         :return bool: If the server was updated
         """
         context.failure_severity = self.severity
@@ -98,24 +112,20 @@ class Software:
         servers = load("data/servers.json", default="{}").json
         server_info = servers[server]
         destination_path = server_info["path"] + server_info["software"][self.name]["copy_path"]
-        # Generate destination file...
-        try:
-            generate(destination_path, default="")
-        except Exception as e:
-            report(self.severity, f"copy - {self.name} > {server}", f"Could not generate destination file at " +
-                   f"{destination_path}! Could be a permission error.",
-                   exception=e, software=self.name)
-            cli.fail(f"Could not copy {self.name} to {server}!")
-            return False
+        config = load("data/config.json", default=CONFIG).json
+        deploy_mode = server_info["deploy_mode"] if "deploy_mode" in server_info else config.get("deploy_mode", CONFIG["deploy_mode"])
 
         # Copy file
         try:
-            copy(self.file, destination_path)
+            deploy_file(self.file, destination_path if staging is None else staging, deploy_mode,
+                        config.get("fsync", CONFIG["fsync"]))
         except Exception as e:
             report(self.severity, f"copy - {self.name} > {server}", "Copy process did not finish: ",
-                   exception=e, software=self.name)
-            cli.fail(f"Could not copy {self.name} to {server} - see errors.json!")
+                   exception=e, software=self.name, additional=f"Destination: {destination_path}; mode: {deploy_mode}")
+            cli.fail(f"Could not copy {self.name} to {server} - see errors.jsonl!")
             return False
+        if staging is None:
+            record(server, destination_path, self.hash)
         return True
 
 
@@ -1,14 +1,16 @@
 """
 Source management tools
 """
-import datetime
+import json
 import sys
-from os import remove, makedirs
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import remove, makedirs, path, stat
 from shutil import copy, rmtree
-from typing import Union, Dict
-
-from requests import get
+from threading import Lock
+from time import time
+from typing import Any, Union, Dict, List, Tuple
 
+import utils.artifact_store as artifact_store
 import utils.cli as cli
 from .access_fields import WebAccessField
 from .context_manager import context
@@ -16,13 +18,18 @@ from .dict_utils import enabled
 from .errors import report
 from .events import report as report_event
 from .file_defaults import CONFIG
-from singlejson import load
-from .io import abs_filename
+from .state import load
+from .io import abs_filename, replace_file
+from .jar_metadata import api_version
+from .sha244 import DownloadHash
 from .tasks import execute
-from .versions import Version, VersionRangeRequirement, DEFAULT_VERSION
+from .web import host_slot, limited_get
+from .versions import Version, VersionRangeRequirement, DEFAULT_VERSION, is_valid
 
 config = load("data/config.json", default=CONFIG).json
 SOURCES_DIR = config["sources_folder"]
+# Refreshes of results that were served from the last run (max_staleness)
+refresher = ThreadPoolExecutor(max_workers=max(1, config.get("check_workers", CONFIG["check_workers"])))
 
 
 class Source:
@@ -52,6 +59,10 @@ class Source:
             self.headers = self.config["headers"]
         else:
             self.headers = load("data/config.json", default=CONFIG).json["default_headers"]
+        self.max_age = self.config["cache_max_age"] if "cache_max_age" in self.config else None
+        self.max_staleness = self.config["max_staleness"] if "max_staleness" in self.config else 0
+        self.refreshing: Dict[str, Tuple[Any, Future]] = {}  # {kind: (served result, refresh)}
+        self.downloaded_hash: Union[str, None] = None  # Hash of the last downloaded build, computed while downloading
 
         self.severity = all_software[software]["severity"]
         self.file = all_software[software]["file"]
@@ -77,18 +88,18 @@ class Source:
             result = result.replace(this, that)
         return result
 
-    def check_compatibility(self):
+    def check_compatibility(self) -> bool:
         """
         Check for updates to software compatibility
-        :return:
+        :return: Weather or not the compatibility could be retrieved
         """
         if config["debug"]:
             cli.info(f"checking compatibility of {self.name}")
         context.task = "updating compatibility"
-        new_compatibility = WebAccessField(self.config["compatibility"]["remote"]).execute(self.replaceable, headers=self.headers)
+        new_compatibility = self.remote("compatibility")
         if isinstance(new_compatibility, Exception):
             cli.fail("Could not retrieve newest compatibility: " + str(new_compatibility))
-            return None
+            return False
 
         all_software = load("data/software.json", default="{}").json
         previous_compatibility = VersionRangeRequirement(all_software[self.name]["requirements"])
@@ -109,7 +120,7 @@ class Source:
                        f"{self.name} has NO compatibilities (list is empty) ({new_compatibility})",
                        software=self.name)
                 cli.fail("Could not fetch compatibility for " + self.name + " - no compatibilities found!")
-                return None
+                return False
 
             # Retrieve newest and oldest version
             newest = Version("1.0")
@@ -144,7 +155,7 @@ class Source:
                    software=self.name, additional="recieved compatibility: " + str(new_compatibility))
             cli.fail(
                 "Could not fetch compatibility for " + self.name + " - no list of compatibilities or compatibility found!")
-            return None
+            return False
 
         if not previous_compatibility.matches(compatibility):
             all_software[self.name]["requirements"] = compatibility.dict()
@@ -155,7 +166,29 @@ class Source:
         self.replaceable["%newest_version%"] = compatibility.maximum.string()
         self.replaceable["%newest_major%"] = f"1.{compatibility.maximum.major}"
         self.replaceable["%newest_minor%"] = f".{compatibility.minimum.minor}"
-        return None
+        return True
+
+    def check_local_compatibility(self):
+        """
+        Raise the minimum compatible version to the api-version the build declares in its plugin.yml
+        (used if the compatibility can't be retrieved remotely)
+        :return:
+        """
+        context.task = "reading compatibility from plugin.yml"
+        version = api_version(SOURCES_DIR + "/" + self.file, self.downloaded_hash)
+        if version is None or not is_valid(version, verbose=False):
+            return
+        all_software = load("data/software.json", default="{}").json
+        previous_compatibility = VersionRangeRequirement(all_software[self.name]["requirements"])
+        minimum = Version(version)
+        if not minimum.is_higher(previous_compatibility.minimum):
+            return
+        maximum = previous_compatibility.maximum if not minimum.is_higher(previous_compatibility.maximum) else minimum
+        compatibility = VersionRangeRequirement((minimum, maximum))
+        all_software[self.name]["requirements"] = compatibility.dict()
+        cli.success(f"{self.name} requires at least {version} (plugin.yml)")
+        report_event("Compatibility checker",
+                     "Compatibility for " + self.name + " has been changed to " + compatibility.string() + " (plugin.yml)!")
 
     def get_newest_build(self) -> Union[int, str]:
         """
@@ -165,15 +198,13 @@ class Source:
         if not enabled(self.config["build"]):
             return self.config["build"]["local"]
         context.task = "retrieving newest build"
-        buildID = WebAccessField(self.config["build"]["remote"]).execute(self.replaceable, headers=self.headers)
+        buildID = self.remote("build")
         if isinstance(buildID, Exception):
             cli.fail(f"Could not retrieve newest buildID for {self.name} - {buildID}!")
             return self.config["build"]["local"]
             # Return same build, don't do anything
 
         if type(buildID) is str or type(buildID) is int:
-            load("data/sources.json", default="{}").json[self.name]["last_checked"] = datetime.datetime.now().strftime(
-                "%m.%d %H:%M")
             # Single newest build
             return buildID
         if type(buildID) is list:
@@ -185,8 +216,6 @@ class Source:
                 report(self.severity, "download - " + self.name, f"List of builds is EMPTY ({buildID})",
                        software=self.name)
             if len(buildID) == 1:
-                load("data/sources.json", default="{}").json[self.name]["last_checked"] = datetime.datetime.now().strftime(
-                    "%m.%d %H:%M")
                 return int(buildID[0])
             builds = []
             for build in buildID:
@@ -199,8 +228,6 @@ class Source:
                                software=self.name)
                         continue
                 builds.append(build)
-            load("data/sources.json", default="{}").json[self.name]["last_checked"] = datetime.datetime.now().strftime(
-                "%m.%d %H:%M")
             return max(builds)
         # Unknown version type
         cli.fail(f"Could not retrieve valid buildID for {self.name} (unknown type)")
@@ -208,66 +235,117 @@ class Source:
                software=self.name)
         return self.config["build"]["local"]
 
+    def remote(self, kind: str) -> Union[int, str, List, Dict, bool, None, Exception]:
+        """
+        Execute the remote WebAccessField of the build or the compatibility.
+        If the last known result is younger than max_staleness, it is returned immediately and refreshed in the background.
+        :param kind: "build" or "compatibility"
+        :return: the result of the WebAccessField
+        """
+        if kind in self.refreshing:
+            served, refresh = self.refreshing[kind]
+            if not refresh.done():
+                return served
+            self.refreshing.pop(kind)
+            if refresh.exception() is None and not isinstance(refresh.result(), Exception):
+                return refresh.result()  # Refreshed in time, use the new result
+        known = self.config["last_known"] if "last_known" in self.config else {}
+        if kind in known and time() - known[kind]["checked"] < self.max_staleness:
+            self.refreshing[kind] = (known[kind]["value"], refresher.submit(self.refresh, kind, dict(self.replaceable),
+                                                                            context.failure_severity))
+            return known[kind]["value"]
+        result = WebAccessField(self.config[kind]["remote"]).execute(self.replaceable, headers=self.headers, max_age=self.max_age)
+        self.remember(kind, result)
+        return result
+
+    def refresh(self, kind: str, replaceable: Dict[str, str], severity: int) -> Union[int, str, List, Dict, bool, None, Exception]:
+        """
+        Execute the remote WebAccessField of the build or the compatibility in the background
+        :param kind: "build" or "compatibility"
+        :param replaceable: replaceable values at the time the last known result was served
+        :param severity: failure severity of the software
+        :return: the result of the WebAccessField
+        """
+        context.name = self.name
+        context.failure_severity = severity
+        context.task = f"refreshing {kind}"
+        result = WebAccessField(self.config[kind]["remote"]).execute(replaceable, headers=self.headers, max_age=self.max_age)
+        self.remember(kind, result)
+        return result
+
+    def remember(self, kind: str, result):
+        """
+        Save a result of the remote WebAccessField, so it can be served while it is refreshed next time
+        :param kind: "build" or "compatibility"
+        :param result: result of the WebAccessField
+        :return:
+        """
+        if isinstance(result, Exception):
+            return
+        if "last_known" not in self.config:
+            self.config["last_known"] = {}
+        self.config["last_known"][kind] = {"value": result, "checked": int(time())}
+        if kind == "build":
+            self.config["last_checked"] = int(time())
+
+    def refreshed(self) -> bool:
+        """
+        Check if a refresh finished with a different result than the one that was served
+        :return: Weather or not the update should be repeated with the refreshed results
+        """
+        for served, refresh in self.refreshing.values():
+            if refresh.done() and refresh.exception() is None and not isinstance(refresh.result(), Exception) \
+                    and refresh.result() != served:
+                return True
+        return False
+
     def download_build(self) -> bool:
         """
         Downlaod the newest build and put it into the software directory
         :return: Weather or not the download has been successful
         """
         context.task = "downloading newest build"
-        url = WebAccessField(self.config["build"]["download"]).execute(self.replaceable, headers=self.headers)
+        self.downloaded_hash = None
+        url = WebAccessField(self.config["build"]["download"]).execute(self.replaceable, headers=self.headers, max_age=self.max_age)
         if isinstance(url, Exception):
             cli.fail(f"Could not retrieve newest download URL for {self.name}: {url}")
             return False
+        checksum = None
+        if "checksum" in self.config["build"]:
+            checksum = WebAccessField(self.config["build"]["checksum"]["value"]).execute(self.replaceable, headers=self.headers, max_age=self.max_age)
+            if isinstance(checksum, Exception):
+                cli.fail(f"Could not retrieve checksum of the newest build for {self.name}: {checksum}")
+                return False
         try:
-            response = get(url, stream=True, allow_redirects=True, headers=self.headers)
-        except Exception as e:
-            cli.fail(f"Error while downloading {self.name} from {self.server}: {e}")
-            report(self.severity, f"download - {self.name}", "exception occurred while downloading!",
-                   software=self.name, exception=e, additional=f"URL: {url}")
-            return False
-        if response.status_code != 200:
-            cli.fail(f"Error while downloading {self.name} from {self.server} - status code {response.status_code}!")
-            report(self.severity, f"download - {self.name}",
-                   f"Download finished with code {response.status_code}",
-                   software=self.name, additional=f"URL: {url}")
+            download_hash = DownloadHash(self.config["build"]["checksum"]["algorithm"] if checksum is not None else None)
+        except ValueError as e:
+            cli.fail(f"Unknown checksum algorithm for {self.name}: {e}")
+            report(self.severity, "download - " + self.name, "Typo in config: unknown checksum algorithm",
+                   software=self.name, exception=e)
             return False
-        total_length = response.headers.get('content-length')
         progress = cli.progress_bar(f"Downloading {self.name} from {self.server}")
-
-        with open(SOURCES_DIR + "/" + self.file + ".tmp", "wb") as temporary_file:
-            if total_length is None:
-                try:
-                    temporary_file.write(response.content)
-                except Exception as e:
-                    progress.fail("Error while writing to disk: ")
-                    print(e)
-                    report(self.severity, "download - " + self.name, "Could not write to disk!",
-                           software=self.name, exception=e)
-                    return False
-            else:
-                try:
-                    dl = 0
-                    total_length = int(total_length)
-                    for data in response.iter_content(chunk_size=load("data/config.json", default=CONFIG).json["batch_size"]):
-                        dl = dl + len(data)  # Should be 1024
-                        temporary_file.write(data)
-                        done = 100 - int(((total_length - dl) / total_length) * 100)  # 100 - (remaining / total)*100
-                        progress.update(done)
-                except Exception as e:
-                    progress.fail("Error while writing chunk to disk: ")
-                    print(e)
-                    report(self.severity, "download - " + self.name, "Could not write chunk to disk!",
-                           software=self.name, exception=e)
-                    try:
-                        remove(SOURCES_DIR + "/" + self.file + ".tmp")
-                    except Exception as e:
-                        cli.fail("Error while removing temporary file: (NON-FATAL)")
-                        print(e)
-                        report(int(self.severity / 2), f"download - clean up failure {self.name}",
-                               "Could not delete temporary download file!",
-                               additional="Not deleted: " + self.file + ".tmp", exception=e, software=self.name)
-
-                    return False
+        with host_slot(url):
+            if not self.fetch(url, progress, download_hash):
+                return False
+        try:
+            file_hash, file_checksum = download_hash.finish(SOURCES_DIR + "/" + self.file + ".tmp")
+        except Exception as e:
+            report(int(self.severity / 4), "download - " + self.name, "Could not hash the downloaded build (NON-FATAL)",
+                   software=self.name, exception=e)
+            file_hash = file_checksum = None
+        if checksum is not None and file_checksum is not None and file_checksum != str(checksum).lower():
+            progress.fail(f"Downloaded build of {self.name} does not match the upstream checksum!")
+            report(self.severity, "download - " + self.name, "Checksum of the downloaded build does not match!",
+                   software=self.name, additional=f"URL: {url}; expected: {checksum}; got: {file_checksum}")
+            try:
+                remove(SOURCES_DIR + "/" + self.file + ".tmp")
+            except Exception as e:
+                report(int(self.severity / 2), f"download - clean up failure {self.name}",
+                       "Could not delete temporary download file!",
+                       additional="Not deleted: " + self.file + ".tmp", exception=e, software=self.name)
+            return False
+        if "tasks" not in self.config or not enabled(self.config["tasks"]):
+            self.downloaded_hash = file_hash  # Tasks may change the file
 
         if "tasks" in self.config and enabled(self.config["tasks"]):
             context.task = "executing after update tasks"
@@ -349,24 +427,289 @@ class Source:
         progress.update_message("Cleaning up...")
         progress.update(5)
         try:
-            copy(SOURCES_DIR + "/" + self.file + ".tmp", SOURCES_DIR + "/" + self.file)
+            if artifact_store.enabled():
+                if self.downloaded_hash is None:  # Changed by tasks
+                    self.downloaded_hash = DownloadHash().finish(SOURCES_DIR + "/" + self.file + ".tmp")[0]
+                artifact_store.add(SOURCES_DIR + "/" + self.file + ".tmp", self.downloaded_hash, self.name,
+                                   self.replaceable["%build%"], config.get("fsync", CONFIG["fsync"]))
+                artifact_store.deploy(self.downloaded_hash, self.name, SOURCES_DIR + "/" + self.file)
+            else:
+                replace_file(SOURCES_DIR + "/" + self.file + ".tmp", SOURCES_DIR + "/" + self.file,
+                             config.get("fsync", CONFIG["fsync"]))
         except Exception as e:
-            progress.fail(f"Error while copying downloaded .tmp file for {self.name}: {e}")
-            report(self.severity, "copy - " + self.name, "Could not copy downloaded files!",
+            progress.fail(f"Error while moving downloaded .tmp file for {self.name}: {e}")
+            report(self.severity, "copy - " + self.name, "Could not move downloaded file to its final destination!",
                    software=self.name, exception=e)
             return False
-        progress.update(50)
+
+        progress.complete("Updated " + self.name, vanish=True)
+        return True
+
+    def restore_build(self) -> bool:
+        """
+        Use the newest build from the artifact store instead of downloading it again
+        :return: Weather or not the build has been restored
+        """
+        self.downloaded_hash = None
+        digest = artifact_store.lookup(self.name, self.replaceable["%build%"])
+        if digest is None:
+            return False
         try:
-            remove(SOURCES_DIR + "/" + self.file + ".tmp")
+            artifact_store.deploy(digest, self.name, SOURCES_DIR + "/" + self.file)
         except Exception as e:
-            progress.fail(f"Error while removing downloaded file for {self.name}: {e}")
-            report(int(self.severity / 2), "download - " + self.name, "Could not delete temporary files!",
-                   additional="Not deleted: " + self.file + ".tmp", exception=e, software=self.name)
-            return True
+            report(int(self.severity / 2), "artifact store - " + self.name, "Could not restore stored build, downloading it",
+                   software=self.name, exception=e)
+            return False
+        cli.info(f"Restored build {self.replaceable['%build%']} of {self.name} from the artifact store", vanish=True)
+        self.downloaded_hash = digest
+        return True
 
-        progress.complete("Updated " + self.name, vanish=True)
+    def fetch(self, url: str, progress, download_hash: DownloadHash) -> bool:
+        """
+        Download a build into the temporary file, the host_slot of the url has to be held
+        Interrupted downloads are resumed if the server still has the same file.
+        :param url: URL to download the build from
+        :param progress: ProgressBar to display the download progress in
+        :param download_hash: DownloadHash to hash the downloaded data with
+        :return: Weather or not the download has been successful
+        """
+        try:
+            response = limited_get(url, self.headers, host_slot(url), stream=True, allow_redirects=True)
+        except Exception as e:
+            cli.fail(f"Error while downloading {self.name} from {self.server}: {e}")
+            report(self.severity, f"download - {self.name}", "exception occurred while downloading!",
+                   software=self.name, exception=e, additional=f"URL: {url}")
+            return False
+        if response.status_code != 200:
+            response.close()
+            cli.fail(f"Error while downloading {self.name} from {self.server} - status code {response.status_code}!")
+            report(self.severity, f"download - {self.name}",
+                   f"Download finished with code {response.status_code}",
+                   software=self.name, additional=f"URL: {url}")
+            return False
+        total_length = response.headers.get('content-length')
+        validator = response.headers.get("ETag", response.headers.get("Last-Modified"))
+        # Byte ranges would be of the encoded file, only use them for plain downloads
+        ranges_supported = total_length is not None and response.headers.get("Accept-Ranges") == "bytes" \
+            and "Content-Encoding" not in response.headers
+        if ranges_supported:
+            segmented = config.get("segmented_downloads", CONFIG["segmented_downloads"])
+            segments = segmented["segments"] \
+                if segmented["enabled"] and int(total_length) >= segmented["min_size"] * 1024 * 1024 else 1
+            missing = self.resumable(url, validator, int(total_length))
+            if missing is not None:
+                response.close()
+                cli.info(f"Resuming download of {self.name}", vanish=True)
+                return self.fetch_ranges(url, response.url, int(total_length), missing, segments, validator, progress,
+                                         download_hash)
+            if segments > 1:
+                response.close()
+                return self.fetch_ranges(url, response.url, int(total_length), [[0, int(total_length) - 1]], segments,
+                                         validator, progress, download_hash)
+            if validator is not None:
+                self.save_resume_info(url, validator, int(total_length), None)
+
+        with response, open(SOURCES_DIR + "/" + self.file + ".tmp", "wb") as temporary_file:
+            if total_length is None:
+                try:
+                    content = response.content
+                    temporary_file.write(content)
+                    download_hash.update(0, content)
+                except Exception as e:
+                    progress.fail("Error while writing to disk: ")
+                    print(e)
+                    report(self.severity, "download - " + self.name, "Could not write to disk!",
+                           software=self.name, exception=e)
+                    return False
+            else:
+                try:
+                    dl = 0
+                    total_length = int(total_length)
+                    for data in response.iter_content(chunk_size=load("data/config.json", default=CONFIG).json["batch_size"]):
+                        temporary_file.write(data)
+                        download_hash.update(dl, data)
+                        dl = dl + len(data)  # Should be 1024
+                        done = 100 - int(((total_length - dl) / total_length) * 100)  # 100 - (remaining / total)*100
+                        progress.update(done)
+                except Exception as e:
+                    if ranges_supported and validator is not None:
+                        progress.fail(f"Download of {self.name} interrupted, it will be resumed next time: {e}")
+                        report(int(self.severity / 2), "download - " + self.name,
+                               "Download interrupted, the downloaded part has been kept to resume the download.",
+                               software=self.name, exception=e, additional=f"Downloaded {dl} of {total_length} bytes")
+                        return False
+                    progress.fail("Error while writing chunk to disk: ")
+                    print(e)
+                    report(self.severity, "download - " + self.name, "Could not write chunk to disk!",
+                           software=self.name, exception=e)
+                    try:
+                        remove(SOURCES_DIR + "/" + self.file + ".tmp")
+                    except Exception as e:
+                        cli.fail("Error while removing temporary file: (NON-FATAL)")
+                        print(e)
+                        report(int(self.severity / 2), f"download - clean up failure {self.name}",
+                               "Could not delete temporary download file!",
+                               additional="Not deleted: " + self.file + ".tmp", exception=e, software=self.name)
+
+                    return False
+        self.remove_resume_info()
         return True
 
+    def fetch_ranges(self, url: str, location: str, total_length: int, ranges: List[List[int]], segments: int,
+                     validator: Union[str, None], progress, download_hash: DownloadHash) -> bool:
+        """
+        Download byte ranges of a build into the temporary file, the ranges are fetched concurrently
+        The first segment uses the connection slot of the download, further segments are only used if the host has free slots.
+        :param url: URL of the build (used to recognize the download when resuming)
+        :param location: URL to download the build from (after redirects)
+        :param total_length: size of the build
+        :param ranges: byte ranges to download ([first byte, last byte]), other parts of the temporary file are complete
+        :param segments: maximum amount of concurrent connections
+        :param validator: ETag / Last-Modified of the build, None if the download can't be resumed
+        :param progress: ProgressBar to display the download progress in
+        :param download_hash: DownloadHash to hash the downloaded data with, segments after the first are hashed when finishing
+        :return: Weather or not the download has been successful
+        """
+        slot = host_slot(location)
+        extra_slots = 0
+        while extra_slots < segments - 1 and slot.acquire(blocking=False):
+            extra_slots = extra_slots + 1
+        ranges = split_ranges(ranges, extra_slots + 1)
+        positions = [start for start, _ in ranges]
+        batch_size = load("data/config.json", default=CONFIG).json["batch_size"]
+        downloaded = [total_length - sum(end - start + 1 for start, end in ranges)]
+        downloaded_lock = Lock()
+        saved = [time()]
+
+        def missing() -> List[List[int]]:
+            """
+            Get the byte ranges that are not downloaded yet
+            :return: the missing byte ranges
+            """
+            return [[positions[index], end] for index, (_, end) in enumerate(ranges) if positions[index] <= end]
+
+        def fetch_range(index: int):
+            """
+            Download a byte range into the preallocated temporary file
+            :param index: index of the range
+            :return:
+            """
+            start, end = ranges[index]
+            headers = dict(self.headers)
+            headers["Range"] = f"bytes={start}-{end}"
+            if validator is not None:
+                headers["If-Range"] = validator  # Get the whole file (200) if it changed
+            with limited_get(location, headers, stream=True) as response:
+                if response.status_code != 206:
+                    raise SegmentedDownloadException(f"server answered range request with status code {response.status_code}")
+                # Unbuffered, so the saved positions are always written to the file
+                with open(SOURCES_DIR + "/" + self.file + ".tmp", "r+b", buffering=0) as temporary_file:
+                    temporary_file.seek(start)
+                    for data in response.iter_content(chunk_size=batch_size):
+                        if positions[index] + len(data) > end + 1:
+                            raise SegmentedDownloadException(f"server sent more than the requested range {start}-{end}")
+                        temporary_file.write(data)
+                        download_hash.update(positions[index], data)
+                        positions[index] = positions[index] + len(data)
+                        with downloaded_lock:
+                            downloaded[0] = downloaded[0] + len(data)
+                            progress.update(int((downloaded[0] / total_length) * 100))
+                            if validator is not None and time() - saved[0] > 1:
+                                # Save the progress to be able to resume after the program was killed
+                                self.save_resume_info(url, validator, total_length, missing())
+                                saved[0] = time()
+            if positions[index] != end + 1:
+                raise SegmentedDownloadException(f"range {start}-{end} ended at byte {positions[index]}")
+
+        try:
+            if downloaded[0] == 0:
+                with open(SOURCES_DIR + "/" + self.file + ".tmp", "wb") as temporary_file:
+                    temporary_file.truncate(total_length)  # Preallocate, segments are written in place
+            if validator is not None:
+                self.save_resume_info(url, validator, total_length, ranges)
+            with ThreadPoolExecutor(max_workers=extra_slots + 1) as executor:
+                for future in [executor.submit(fetch_range, index) for index in range(len(ranges))]:
+                    future.result()
+        except Exception as e:
+            if validator is not None and not isinstance(e, SegmentedDownloadException):
+                remaining = missing()
+                self.save_resume_info(url, validator, total_length, remaining)
+                progress.fail(f"Download of {self.name} interrupted, it will be resumed next time: {e}")
+                report(int(self.severity / 2), "download - " + self.name,
+                       "Download interrupted, the downloaded part has been kept to resume the download.",
+                       software=self.name, exception=e,
+                       additional=f"Missing {sum(end - start + 1 for start, end in remaining)} of {total_length} bytes")
+                return False
+            progress.fail(f"Error while downloading {self.name} in {len(ranges)} segments: {e}")
+            report(self.severity, "download - " + self.name, "Segmented download failed!",
+                   software=self.name, exception=e, additional=f"URL: {location}")
+            self.remove_resume_info()
+            try:
+                remove(SOURCES_DIR + "/" + self.file + ".tmp")
+            except Exception as e:
+                cli.fail("Error while removing temporary file: (NON-FATAL)")
+                print(e)
+                report(int(self.severity / 2), f"download - clean up failure {self.name}",
+                       "Could not delete temporary download file!",
+                       additional="Not deleted: " + self.file + ".tmp", exception=e, software=self.name)
+            return False
+        finally:
+            for _ in range(extra_slots):
+                slot.release()
+        self.remove_resume_info()
+        return True
+
+    def resumable(self, url: str, validator: Union[str, None], total_length: int) -> Union[List[List[int]], None]:
+        """
+        Check if an interrupted download of the same build can be resumed
+        :param url: URL of the build
+        :param validator: current ETag / Last-Modified of the build
+        :param total_length: current size of the build
+        :return: the byte ranges that are still missing or None if the download has to start from the beginning
+        """
+        if validator is None or not path.exists(SOURCES_DIR + "/" + self.file + ".tmp"):
+            return None
+        try:
+            with open(SOURCES_DIR + "/" + self.file + ".resume.tmp", "r") as resume_file:
+                info = json.load(resume_file)
+        except (OSError, ValueError):
+            return None
+        if info["url"] != url or info["validator"] != validator or info["length"] != total_length:
+            return None  # Build changed upstream
+        if info["missing"] is None:
+            # Written from the beginning, everything already in the file is complete
+            size = stat(SOURCES_DIR + "/" + self.file + ".tmp").st_size
+            if size == 0 or size > total_length:
+                return None
+            return [[size, total_length - 1]] if size < total_length else []
+        return info["missing"]
+
+    def save_resume_info(self, url: str, validator: str, total_length: int, missing: Union[List[List[int]], None]):
+        """
+        Save the information required to resume the download next to the temporary file
+        :param url: URL of the build
+        :param validator: ETag / Last-Modified of the build
+        :param total_length: size of the build
+        :param missing: byte ranges that are not downloaded yet, None if the file is written from the beginning
+        :return:
+        """
+        try:
+            with open(SOURCES_DIR + "/" + self.file + ".resume.tmp", "w") as resume_file:
+                json.dump({"url": url, "validator": validator, "length": total_length, "missing": missing}, resume_file)
+        except OSError as e:
+            report(int(self.severity / 4), "download - " + self.name, "Could not save resume information (NON-FATAL)",
+                   software=self.name, exception=e)
+
+    def remove_resume_info(self):
+        """
+        Remove the resume information after the download is complete
+        :return:
+        """
+        try:
+            remove(SOURCES_DIR + "/" + self.file + ".resume.tmp")
+        except OSError:
+            pass  # Nothing to resume
+
     def update(self, check: bool, force_retrieve: bool) -> bool:
         """
         Try to find updates for this source and update if necessary
@@ -374,18 +717,53 @@ class Source:
         :param force_retrieve: Weather to force download the software
         :return: Weather or not the update was successful
         """
+        compatibility_known = False
         if "compatibility" in self.config and enabled(self.config["compatibility"]) and \
                 (self.config["compatibility"]["check"] == "always" or check):
-            self.check_compatibility()
+            compatibility_known = self.check_compatibility()
         newest_build = self.get_newest_build()
         cli.info(f"Newest build for {self.name} is {newest_build}", vanish=True)
         if newest_build != self.config["build"]["local"] or force_retrieve:
             self.replaceable["%build%"] = newest_build
             if "compatibility" in self.config and enabled(self.config["compatibility"]) and \
                     self.config["compatibility"]["check"] == "build" and not check:
-                self.check_compatibility()
-            if self.download_build():
+                compatibility_known = self.check_compatibility()
+            if self.restore_build() or self.download_build():
                 self.config["build"]["local"] = newest_build
+                if not compatibility_known:
+                    self.check_local_compatibility()
                 cli.success(f"Downloaded build {newest_build} for {self.name}!")
                 return True
         return False
+
+
+def wait_for_refreshes():
+    """
+    Wait until all background refreshes are finished, so their results can be saved
+    :return:
+    """
+    refresher.shutdown(wait=True)
+
+
+class SegmentedDownloadException(Exception):
+    """
+    An error describing a faulty response to a byte range request
+    """
+
+
+def split_ranges(ranges: List[List[int]], segments: int) -> List[List[int]]:
+    """
+    Split up byte ranges until there are enough ranges to use all segments
+    :param ranges: byte ranges ([first byte, last byte])
+    :param segments: amount of segments to download at the same time
+    :return: the split ranges
+    """
+    ranges = [list(byte_range) for byte_range in ranges]
+    while 0 < len(ranges) < segments:
+        largest = max(ranges, key=lambda byte_range: byte_range[1] - byte_range[0])
+        if largest[1] - largest[0] < 1:
+            break
+        middle = (largest[0] + largest[1]) // 2
+        ranges.append([middle + 1, largest[1]])
+        largest[1] = middle
+    return sorted(ranges)
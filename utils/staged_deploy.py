@@ -0,0 +1,151 @@
+"""
+Staged deployment: all software for a server is prepared next to its destination and then moved in at once
+A journal is written before anything in the server is changed, an interrupted commit is rolled back on the next start.
+"""
+import json
+from os import link, path, remove
+from typing import List, Tuple
+
+import utils.cli as cli
+from .errors import report
+from .events import report as report_event
+from .io import replace_file, sync_directory
+
+STAGING_LIST = ".deploy-staging.json"  # Destinations of the files that are being staged
+JOURNAL = ".deploy-journal.json"
+
+
+def staging_file(destination: str) -> str:
+    """
+    Get the file software for a destination is staged in, it is in the same folder so moving it in is atomic
+    :param destination: file in the server
+    :return: the staged file
+    """
+    return destination + ".staged"
+
+
+def backup_file(destination: str) -> str:
+    """
+    Get the file the previous software is kept in while committing
+    :param destination: file in the server
+    :return: the backup file
+    """
+    return destination + ".previous"
+
+
+def prepare(server_path: str, destinations: List[str]):
+    """
+    Remember which files are staged in a server, so they can be cleaned up if the deployment is interrupted
+    :param server_path: path of the server
+    :param destinations: files in the server that get new software
+    :return:
+    """
+    with open(server_path + "/" + STAGING_LIST + ".tmp", "w") as staging_list:
+        json.dump(destinations, staging_list)
+    replace_file(server_path + "/" + STAGING_LIST + ".tmp", server_path + "/" + STAGING_LIST, "never")
+
+
+def discard(server_path: str):
+    """
+    Remove all staged files and backups of a server
+    :param server_path: path of the server
+    :return:
+    """
+    if not path.exists(server_path + "/" + STAGING_LIST):
+        return
+    with open(server_path + "/" + STAGING_LIST, "r") as staging_list:
+        destinations = json.load(staging_list)
+    for destination in destinations:
+        for file in (staging_file(destination), backup_file(destination)):
+            if path.exists(file):
+                remove(file)
+    remove(server_path + "/" + STAGING_LIST)
+
+
+def write_journal(server_path: str, entries: List[dict]):
+    """
+    Write the journal of a commit to disk before anything is changed
+    :param server_path: path of the server
+    :param entries: [{staged, destination, backup}]
+    :return:
+    """
+    with open(server_path + "/" + JOURNAL + ".tmp", "w") as journal:
+        json.dump(entries, journal)
+    replace_file(server_path + "/" + JOURNAL + ".tmp", server_path + "/" + JOURNAL, "full")
+
+
+def commit(server_path: str, staged: List[Tuple[str, str]], fsync_policy: str):
+    """
+    Move all staged software into the server. The previous files are hard linked to backups first (before the journal
+    is written), so an interrupted commit can be rolled back. Nothing is copied, files that can't be linked
+    (e.g. no support for links) have no backup and keep their new software if the commit is interrupted.
+    :param server_path: path of the server
+    :param staged: [(staged file, destination)]
+    :param fsync_policy: see config.json fsync
+    :return:
+    """
+    entries = []
+    for staged_file, destination in staged:
+        backup = None
+        if path.exists(destination):
+            if path.exists(backup_file(destination)):
+                remove(backup_file(destination))
+            try:
+                link(destination, backup_file(destination))
+                backup = backup_file(destination)
+            except OSError:
+                pass  # Links not supported
+        entries.append({"staged": staged_file, "destination": destination, "backup": backup,
+                        "new": not path.exists(destination)})
+    write_journal(server_path, entries)
+    for entry in entries:
+        replace_file(entry["staged"], entry["destination"], "never")  # Staged files have been flushed already
+    if fsync_policy == "full":
+        for directory in {path.dirname(path.abspath(entry["destination"])) for entry in entries}:
+            sync_directory(directory)
+    remove(server_path + "/" + JOURNAL)
+    discard(server_path)
+
+
+def roll_back(server_path: str, entries: List[dict], fsync_policy: str):
+    """
+    Roll back an interrupted commit: the backups are moved back and new software is removed
+    :param server_path: path of the server
+    :param entries: journal entries
+    :param fsync_policy: see config.json fsync
+    :return:
+    """
+    for entry in entries:
+        if entry["backup"] is not None and path.exists(entry["backup"]):
+            replace_file(entry["backup"], entry["destination"], "never")
+        elif entry["new"] and path.exists(entry["destination"]) and not path.exists(entry["staged"]):
+            remove(entry["destination"])  # Moved in before the interruption
+    if fsync_policy == "full":
+        for directory in {path.dirname(path.abspath(entry["destination"])) for entry in entries}:
+            sync_directory(directory)
+    remove(server_path + "/" + JOURNAL)
+    discard(server_path)
+
+
+def recover(server_name: str, server_path: str, fsync_policy: str):
+    """
+    Roll back a commit that has been interrupted and remove the files of an interrupted staging
+    :param server_name: name of the server
+    :param server_path: path of the server
+    :param fsync_policy: see config.json fsync
+    :return:
+    """
+    try:
+        if not path.exists(server_path + "/" + JOURNAL):
+            discard(server_path)  # Interrupted before committing, nothing changed
+            return
+        with open(server_path + "/" + JOURNAL, "r") as journal:
+            entries = json.load(journal)
+        roll_back(server_path, entries, fsync_policy)
+    except Exception as e:
+        cli.fail(f"Could not roll back the interrupted deployment of {server_name}: {e}")
+        report(9, "staged deploy - " + server_name, "Could not roll back interrupted deployment, please check the server!",
+               exception=e, additional=f"Journal: {server_path}/{JOURNAL}")
+        return
+    cli.warn(f"Rolled back the interrupted deployment of {server_name}, it is deployed again in this run")
+    report_event("staged deploy - " + server_name, "Rolled back interrupted deployment of " + str(len(entries)) + " files")
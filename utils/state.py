@@ -0,0 +1,277 @@
+"""
+Storage of the state (software.json, sources.json, servers.json) in JSON files (default) or in a SQLite database.
+load() and sync() are used like the ones of singlejson, other files are handled by singlejson.
+"""
+import json
+import sqlite3
+import sys
+from collections.abc import MutableMapping
+from os import makedirs, path
+from threading import RLock
+from typing import Any, Dict, Iterator, List, Set, Union
+
+import singlejson
+
+from .file_defaults import CONFIG
+from .io import replace_file
+
+STATE_FILES = {"data/software.json": "software", "data/sources.json": "sources", "data/servers.json": "servers"}
+config = singlejson.load("data/config.json", default=CONFIG).json
+settings: dict = config.get("state_store", CONFIG["state_store"])
+database: Union[sqlite3.Connection, None] = None
+database_lock = RLock()
+state_files: Dict[str, "StateFile"] = {}
+
+
+def connect() -> sqlite3.Connection:
+    """
+    Open the state database
+    :return: the connection
+    """
+    global database
+    with database_lock:
+        if database is None:
+            if path.dirname(settings["database"]) != "":
+                makedirs(path.dirname(settings["database"]), exist_ok=True)
+            database = sqlite3.connect(settings["database"], check_same_thread=False)
+            database.execute("PRAGMA journal_mode=WAL")
+            database.execute("PRAGMA synchronous=" + {"never": "OFF", "file": "NORMAL", "full": "FULL"}.get(
+                config.get("fsync", CONFIG["fsync"]), "NORMAL"))
+        return database
+
+
+def create_table(table: str) -> bool:
+    """
+    Create the table of a state file if it does not exist yet
+    :param table: name of the table
+    :return: Weather or not the table has been created
+    """
+    with database_lock:
+        if connect().execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+                             (table,)).fetchone() is not None:
+            return False
+        with connect():
+            connect().execute(f"CREATE TABLE {table} (name TEXT PRIMARY KEY, record TEXT NOT NULL)")
+        return True
+
+
+class Records(MutableMapping):
+    """
+    The records of a table, every record is only read from the database when it is accessed
+    """
+
+    def __init__(self, table: str):
+        """
+        Open the records of a table
+        :param table: name of the table
+        """
+        self.table = table
+        self.loaded: Dict[str, Any] = {}
+        self.stored: Dict[str, str] = {}  # {name: record as stored in the database}
+        self.deleted: Set[str] = set()
+        with database_lock:
+            # Insertion order like the dicts of the JSON files, records keep their rowid when they are changed
+            self.names: List[str] = [row[0] for row in connect().execute(f"SELECT name FROM {table} ORDER BY rowid")]
+
+    def __getitem__(self, name: str) -> Any:
+        with database_lock:
+            if name in self.loaded:
+                return self.loaded[name]
+            if name in self.deleted:
+                raise KeyError(name)
+            row = connect().execute(f"SELECT record FROM {self.table} WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise KeyError(name)
+            self.stored[name] = row[0]
+            self.loaded[name] = json.loads(row[0])
+            return self.loaded[name]
+
+    def __setitem__(self, name: str, record: Any):
+        with database_lock:
+            if name not in self.loaded and name not in self.names:
+                self.names.append(name)
+            self.loaded[name] = record  # Stays in deleted, a record that is added again moves to the end like in a dict
+
+    def __delitem__(self, name: str):
+        with database_lock:
+            if name not in self:
+                raise KeyError(name)
+            self.names.remove(name)
+            self.loaded.pop(name, None)
+            self.deleted.add(name)
+
+    def __contains__(self, name: object) -> bool:
+        with database_lock:
+            return name in self.names
+
+    def __iter__(self) -> Iterator[str]:
+        with database_lock:
+            return iter(list(self.names))
+
+    def __len__(self) -> int:
+        with database_lock:
+            return len(self.names)
+
+    def __repr__(self) -> str:
+        return f"<records of {self.table}: {len(self)}>"
+
+    def save(self):
+        """
+        Write the changed records to the database (one transaction)
+        :return:
+        """
+        with database_lock:
+            changed = {}
+            for name, record in self.loaded.items():
+                stored = json.dumps(record, sort_keys=True)
+                if self.stored.get(name) != stored or name in self.deleted:
+                    changed[name] = stored
+            if len(changed) == 0 and len(self.deleted) == 0:
+                return
+            with connect():
+                connect().executemany(f"DELETE FROM {self.table} WHERE name = ?", [(name,) for name in self.deleted])
+                # INSERT OR REPLACE would give changed records a new rowid and move them to the end
+                connect().executemany(f"UPDATE {self.table} SET record = ? WHERE name = ?",
+                                      [(record, name) for name, record in changed.items()])
+                connect().executemany(f"INSERT OR IGNORE INTO {self.table} (name, record) VALUES (?, ?)",
+                                      [(name, changed[name]) for name in self.names if name in changed])
+            for name in self.deleted:
+                self.stored.pop(name, None)
+            self.stored.update(changed)
+            self.deleted = set()
+
+
+class StateFile:
+    """
+    A state file stored in the database, used like a singlejson JSONFile
+    """
+
+    def __init__(self, table: str, filename: str):
+        """
+        Open the table of a state file, the table is imported from the JSON file if it does not exist yet
+        :param table: name of the table
+        :param filename: the JSON file
+        """
+        self.table = table
+        with database_lock:
+            if create_table(table) and path.exists(filename):
+                import_json(table, filename)
+        self.records = Records(table)
+
+    @property
+    def json(self) -> Records:
+        """
+        The records, used like the dict of a JSONFile
+        :return: the records
+        """
+        return self.records
+
+    @json.setter
+    def json(self, records: dict):
+        if records is self.records:
+            return
+        for name in list(self.records):
+            del self.records[name]
+        for name, record in records.items():
+            self.records[name] = record
+
+    def reload(self):
+        """
+        Forget all changes that have not been saved
+        :return:
+        """
+        self.records = Records(self.table)
+
+    def save(self):
+        """
+        Save the changed records
+        :return:
+        """
+        self.records.save()
+
+
+def backend_file(filename: str) -> Union[str, None]:
+    """
+    Get the table a file is stored in
+    :param filename: the file
+    :return: name of the table or None if the file is not stored in the database
+    """
+    if settings["backend"] != "sqlite":
+        return None
+    for state_file, table in STATE_FILES.items():
+        if path.abspath(filename) == path.abspath(state_file):
+            return table
+    return None
+
+
+def load(filename: str, default: Any = "{}") -> Union[StateFile, singlejson.JSONFile]:
+    """
+    Open a JSON file, state files are opened in the database if the sqlite backend is used
+    :param filename: the file
+    :param default: default content of the file (singlejson)
+    :return: a StateFile or JSONFile
+    """
+    table = backend_file(filename)
+    if table is None:
+        return singlejson.load(filename, default=default)
+    with database_lock:
+        if table not in state_files:
+            state_files[table] = StateFile(table, filename)
+        return state_files[table]
+
+
+def sync():
+    """
+    Save all files and the changed records in the database
+    :return:
+    """
+    singlejson.sync()
+    with database_lock:
+        for state_file in state_files.values():
+            state_file.save()
+
+
+def import_json(table: str, filename: str):
+    """
+    Replace the records of a table with the content of a JSON file
+    :param table: name of the table
+    :param filename: the JSON file
+    :return:
+    """
+    with open(filename, "r") as file:
+        records = json.load(file)
+    with database_lock, connect():
+        connect().execute(f"DELETE FROM {table}")
+        connect().executemany(f"INSERT INTO {table} (name, record) VALUES (?, ?)",
+                              [(name, json.dumps(record, sort_keys=True)) for name, record in records.items()])
+    state_files.pop(table, None)
+
+
+def export_json(table: str, filename: str):
+    """
+    Write all records of a table into a JSON file (singlejson format)
+    :param table: name of the table
+    :param filename: the JSON file
+    :return:
+    """
+    with database_lock:
+        records = {name: json.loads(record) for name, record in
+                   connect().execute(f"SELECT name, record FROM {table} ORDER BY rowid")}
+    with open(filename + ".tmp", "w") as file:
+        json.dump(records, file, indent=4, sort_keys=True)
+    replace_file(filename + ".tmp", filename, config.get("fsync", CONFIG["fsync"]))
+
+
+if __name__ == "__main__":
+    # python -m utils.state import|export: copy the state between the JSON files and the database
+    if len(sys.argv) != 2 or sys.argv[1] not in ["import", "export"]:
+        print("Usage: python -m utils.state import|export")
+        sys.exit(1)
+    for state_file_name, state_table in STATE_FILES.items():
+        create_table(state_table)
+        if sys.argv[1] == "export":
+            export_json(state_table, state_file_name)
+            print(f"Exported {state_file_name}")
+        elif path.exists(state_file_name):
+            import_json(state_table, state_file_name)
+            print(f"Imported {state_file_name}")
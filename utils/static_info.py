@@ -6,7 +6,7 @@ import sys
 from subprocess import run, PIPE
 
 VERSION = "b2.3"
-COMMIT = "could not get commit. see errors.json"
+COMMIT = "could not get commit. see errors.jsonl"
 
 if __name__ == "__main__":
     print("This file is meant to be imported!")
@@ -16,6 +16,6 @@ try:
     commit = run("git log -n 1 --pretty=format:\"%H\"", stdout=PIPE, stderr=PIPE, shell=True, check=True)
     COMMIT = commit.stdout.decode('utf-8')
 except Exception as e:
-    print(f"Could not find current commit: {e}")
+    print(f"Could not find current commit: {e}", file=sys.stderr)
 
 DAYS_SINCE_EPOCH = (datetime.datetime.utcnow() - datetime.datetime(1970, 1, 1)).days
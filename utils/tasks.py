@@ -7,8 +7,9 @@ from typing import Dict
 import utils.cli as cli
 from utils.context_manager import context
 from .errors import report
+from .file_defaults import CONFIG
+from .io import replace_file
 from singlejson import load
-from shutil import copy
 
 
 def replace(string: str, replaceable: Dict[str, str]) -> str:
@@ -56,13 +57,13 @@ def execute(task: dict, directory: str, replaceable: Dict[str, str], final_dest:
         return True
 
     if task_type == "end" and final_dest != "":
-        # Copy a file to its final destination (into the sources folder) to keep it updated
+        # Move a file to its final destination (into the sources folder) to keep it updated
         try:
-            copy(task["value"], final_dest)
+            replace_file(task["value"], final_dest, load("data/config.json", default=CONFIG).json.get("fsync", CONFIG["fsync"]))
         except Exception as e:
             cli.fail(f"Error while executing task \"end\" for {context.name}: {e}")
             report(context.failure_severity, f"Task executor - updating {context.name}",
-                   "Task \"end\" failure - could not copy file to final destination!", software=context.name,
+                   "Task \"end\" failure - could not move file to final destination!", software=context.name,
                    exception=e, additional="File will be cleaned up and deleted - NOT updated")
             return False
         return True
@@ -9,7 +9,7 @@ from os import makedirs, path
 
 from typing import Union, Dict, Tuple
 
-from singlejson import load, sync
+from .state import load, sync
 import utils.cli as cli
 from utils.context_manager import context
 from utils.errors import report
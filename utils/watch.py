@@ -0,0 +1,192 @@
+"""
+Watch the software folder and the software in the servers (inotify) and deploy changed software right away
+"""
+import ctypes
+import ctypes.util
+import struct
+from os import path, read
+from select import select
+from typing import Dict, List, Set, Tuple
+
+from .state import load, sync
+
+import utils.cli as cli
+from .context_manager import context
+from .deploy_plan import execute_plan, installed_hashes, plan_server
+from .errors import report
+from .events import flush as flush_events
+from .file_defaults import CONFIG
+from .software import Software
+from .versions import Version
+
+# linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class Inotify:
+    """
+    Minimal inotify wrapper (linux only)
+    """
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: Dict[int, str] = {}
+
+    def add(self, directory: str):
+        """
+        Watch a directory for files that are written, moved or deleted
+        :param directory: the directory
+        :return:
+        """
+        wd = self.libc.inotify_add_watch(self.fd, path.abspath(directory).encode("utf-8"),
+                                         IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "Could not watch " + directory)
+        self.watches[wd] = path.abspath(directory)
+
+    def read(self, timeout: float) -> Tuple[List[str], bool]:
+        """
+        Wait for events
+        :param timeout: maximum time to wait (seconds)
+        :return: (changed files, weather or not events have been lost)
+        """
+        if not select([self.fd], [], [], timeout)[0]:
+            return [], False
+        data = read(self.fd, 65536)
+        files = []
+        overflow = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0").decode("utf-8")
+            offset = offset + EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif wd in self.watches and name != "":
+                files.append(self.watches[wd] + "/" + name)
+        return files, overflow
+
+
+def affected(files: Set[str], servers: dict, all_software: dict) -> Set[Tuple[str, str]]:
+    """
+    Find out which software has to be checked in which servers
+    :param files: changed files (absolute paths)
+    :param servers: all server data (servers.json)
+    :param all_software: software data (software.json)
+    :return: {(server, software)}
+    """
+    sources_folder = path.abspath(load("data/config.json", default=CONFIG).json["sources_folder"])
+    changed_software = {name for name, info in all_software.items()
+                        if sources_folder + "/" + info["file"] in files}
+    result = set()
+    for server_name, server_info in servers.items():
+        for dependency, info in server_info["software"].items():
+            if dependency in changed_software or path.abspath(server_info["path"] + info["copy_path"]) in files:
+                result.add((server_name, dependency))
+    return result
+
+
+def deploy(files: Set[str]):
+    """
+    Deploy changed software into the servers that use it
+    :param files: changed files (absolute paths)
+    :return:
+    """
+    all_software = load("data/software.json", default="{}").json
+    servers = load("data/servers.json", default="{}").json
+    sources_folder = path.abspath(load("data/config.json", default=CONFIG).json["sources_folder"])
+    known_files = {sources_folder + "/" + info["file"] for info in all_software.values()}
+    for file in files:
+        if path.dirname(file) == sources_folder and file not in known_files and not file.endswith(".tmp") \
+                and path.isfile(file):
+            cli.warn(f"New file {path.basename(file)}, run manager.py to add it")
+    to_check = {(server_name, software_name) for server_name, software_name in affected(files, servers, all_software)
+                if software_name in all_software}  # Unknown software is reported by update.py
+    if len(to_check) == 0:
+        return
+    software_objects = {}
+    for software_name in {software_name for _, software_name in to_check}:
+        software = Software(all_software[software_name], software_name)
+        new_hash = software.get_hash()  # No new builds are looked for, only the local file is checked
+        if new_hash != software.hash:
+            cli.success("Detected update for " + software_name)
+            software.hash = new_hash
+            all_software[software_name]["hash"] = new_hash
+        software_objects[software_name] = software
+
+    current_game_version = Version(load("data/versions.json").json["current_version"])
+    installed = installed_hashes(servers, all_software, to_check)
+    plan = {}
+    for server_name in {server_name for server_name, _ in to_check}:
+        # Only the affected software is planned, version increments (auto_update) are left to update.py
+        server_info = {key: value for key, value in servers[server_name].items() if key != "auto_update"}
+        server_info["software"] = {dependency: info for dependency, info in server_info["software"].items()
+                                   if (server_name, dependency) in to_check}
+        server_plan = plan_server(server_name, server_info, all_software, software_objects,
+                                  current_game_version, installed)
+        if len(server_plan["copies"]) != 0:
+            plan[server_name] = server_plan
+    if len(plan) != 0:  # Our own copies are seen as changes as well, they don't need to be announced
+        progress = cli.progress_bar("Deploying changed software")
+        copied, changed_servers = execute_plan(plan, servers, software_objects, progress)
+        progress.complete(f"Copied {copied} software into {changed_servers} servers")
+    flush_events()
+    sync()
+
+
+def watch():
+    """
+    Watch the software folder and the software in the servers, changes are deployed after debounce seconds without events
+    :return:
+    """
+    context.name = "watch"
+    context.task = "watching for changes"
+    context.failure_severity = 8
+    cli.update_sender("WAT")
+    config = load("data/config.json", default=CONFIG).json
+    debounce = config.get("watch_debounce", CONFIG["watch_debounce"])
+    servers = load("data/servers.json", default="{}").json
+    try:
+        inotify = Inotify()
+        inotify.add(config["sources_folder"])
+        for server_info in servers.values():
+            for info in server_info["software"].values():
+                if path.isdir(path.dirname(server_info["path"] + info["copy_path"])):
+                    inotify.add(path.dirname(server_info["path"] + info["copy_path"]))
+    except (OSError, AttributeError) as e:  # AttributeError: libc without inotify (not linux)
+        cli.fail("Could not watch for changes - see errors.jsonl!")
+        report(context.failure_severity, "watch", "Could not set up inotify watches", exception=e)
+        return
+
+    cli.success(f"Watching {config['sources_folder']} and {len(inotify.watches) - 1} server folders, CTRL-C to stop")
+    try:
+        while True:
+            files, overflow = inotify.read(3600)
+            if len(files) == 0 and not overflow:
+                continue
+            changed = set(files)
+            while True:  # Wait until nothing changed for debounce seconds (e.g. a jar still being copied)
+                files, lost = inotify.read(debounce)
+                if len(files) == 0 and not lost:
+                    break
+                changed.update(files)
+                overflow = overflow or lost
+            if overflow:
+                # Events have been lost, check everything
+                all_software = load("data/software.json", default="{}").json
+                sources_folder = path.abspath(config["sources_folder"])
+                changed.update(sources_folder + "/" + info["file"] for info in all_software.values())
+            deploy(changed)
+            context.name = "watch"
+            context.task = "watching for changes"
+    except KeyboardInterrupt:
+        cli.success("Stopped watching")
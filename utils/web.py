@@ -1,46 +1,205 @@
 """
 manage web requests
 """
-from typing import Dict, List, Union
+from concurrent.futures import Future
+from json import dumps, loads
+from threading import BoundedSemaphore, Lock
+from typing import Dict, List, Tuple, Union
+from urllib.parse import urlparse
 from singlejson import load
 
-from requests import get
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
 
 import utils.cli as cli
 from utils.file_defaults import CONFIG
 from .context_manager import context
 from .errors import report
+from .json_stream import Projection
+from .rate_limit import limiter
+from .response_cache import cache_key, is_fresh, lookup, read, revalidated, store, validators
 
 
 config = load("data/config.json", default=CONFIG).json
 requests: Dict[str, Union[Dict, List, str, int, float, bool, None]] = {}
+in_flight: Dict[str, Future] = {}
+requests_lock = Lock()
+statistics = {"hits": 0, "coalesced": 0, "misses": 0}
+hosts: Dict[str, BoundedSemaphore] = {}
+hosts_lock = Lock()
+shared_session: Union[Session, None] = None
 
 
-def get_managed(url: str, headers: dict) -> Union[Dict, List, str, int, float, bool, None, Exception]:
+def session() -> Session:
+    """
+    Get the session shared by all WebAccessFields and downloads.
+    It keeps a pool of keep-alive connections for every host, so repeated requests skip the TCP / TLS handshake.
+    Headers are not stored in the session, pass them with every request.
+    :return: the shared session
+    """
+    global shared_session
+    with hosts_lock:
+        if shared_session is None:
+            adapter = HTTPAdapter(pool_connections=config.get("pooled_hosts", CONFIG["pooled_hosts"]),
+                                  pool_maxsize=config.get("connections_per_host", CONFIG["connections_per_host"]))
+            shared_session = Session()
+            shared_session.mount("http://", adapter)
+            shared_session.mount("https://", adapter)
+        return shared_session
+
+
+def limited_get(url: str, headers: dict, slot: Union[BoundedSemaphore, None] = None, **kwargs) -> Response:
+    """
+    GET an url using the shared session, respecting the rate limits of the host.
+    Requests answered with 429 (or 503 with Retry-After) are retried after the time the server asks for,
+    or with an increasing backoff if it does not say.
+    :param url: URL to request
+    :param headers: headers to use
+    :param slot: host_slot of the url if the caller holds it, it is released while waiting for the rate limits
+    :param kwargs: other arguments for Session.get
+    :return: the response
+    """
+    host_limiter = limiter(url)
+    retries = config.get("max_retries", CONFIG["max_retries"])
+    attempt = 0
+    while True:
+        host_limiter.wait(slot)
+        response = session().get(url, headers=headers, **kwargs)
+        retry_after = host_limiter.update(response.headers)
+        limited = response.status_code == 429 or (response.status_code == 503 and retry_after is not None)
+        if not limited or attempt >= retries:
+            return response
+        response.close()
+        if retry_after is None:
+            host_limiter.block(2 ** attempt)
+        attempt = attempt + 1
+
+
+def cache_statistics() -> Tuple[int, int, int]:
+    """
+    Count how get_managed requests were answered
+    :return: (hits, coalesced, misses); coalesced requests waited for the same request of another thread
+    """
+    with requests_lock:
+        return statistics["hits"], statistics["coalesced"], statistics["misses"]
+
+
+def connection_statistics() -> Tuple[int, int]:
+    """
+    Count the requests made and the connections opened for them by the shared session
+    (only hosts that are still pooled are counted)
+    :return: (requests, connections), every request above the connections reused a connection
+    """
+    total_requests = total_connections = 0
+    if shared_session is None:
+        return total_requests, total_connections
+    for adapter in set(shared_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                total_requests = total_requests + pool.num_requests
+                total_connections = total_connections + pool.num_connections
+    return total_requests, total_connections
+
+
+def host_slot(url: str) -> BoundedSemaphore:
+    """
+    Get the semaphore limiting the concurrent connections to the host of an url
+    :param url: URL that is going to be requested
+    :return: semaphore for the host (use with "with")
+    """
+    host = urlparse(url).netloc
+    with hosts_lock:
+        if host not in hosts:
+            hosts[host] = BoundedSemaphore(config.get("connections_per_host", CONFIG["connections_per_host"]))
+        return hosts[host]
+
+
+def get_managed(url: str, headers: dict, max_age: Union[int, None] = None,
+                projection: Union[Projection, None] = None) -> Union[Dict, List, str, int, float, bool, None, Exception]:
     """
     Get data from the internet, cached, with easy - to rea errors
+    Concurrent requests for the same URL wait for the first one and share its result.
+    :param url: URL to retrieve data from
+    :param headers: headers to use
+    :param max_age: time (seconds) a response cached on disk is used without revalidation, None for the default
+    :param projection: only keep this part of the response (parsed while downloading if possible)
+    :return: the desired data or an exception (check using isinstance Exception)
+    """
+    key = url if projection is None else url + " " + projection.key()
+    with requests_lock:
+        if key in requests:
+            statistics["hits"] = statistics["hits"] + 1
+            return requests[key]
+        if key in in_flight:
+            statistics["coalesced"] = statistics["coalesced"] + 1
+            flight = in_flight[key]
+        else:
+            statistics["misses"] = statistics["misses"] + 1
+            in_flight[key] = Future()
+            flight = None  # This thread executes the request
+    if flight is not None:
+        return flight.result()
+
+    try:
+        result = fetch_managed(url, headers, max_age, projection)
+    except BaseException as e:
+        with requests_lock:
+            in_flight.pop(key).set_exception(e)
+        raise
+    with requests_lock:
+        if not isinstance(result, Exception):
+            requests[key] = result
+        in_flight.pop(key).set_result(result)
+    return result
+
+
+def fetch_managed(url: str, headers: dict, max_age: Union[int, None],
+                  projection: Union[Projection, None]) -> Union[Dict, List, str, int, float, bool, None, Exception]:
+    """
+    Get data from the internet, responses are cached on disk and revalidated using ETag / Last-Modified.
     :param url: URL to retrieve data from
     :param headers: headers to use
+    :param max_age: time (seconds) a response cached on disk is used without revalidation, None for the default
+    :param projection: only keep this part of the response, None for the whole response
     :return: the desired data or an exception (check using isinstance Exception)
     """
-    if url in requests:
-        return requests[url]
+    # Projections are cached on their own, they are not a complete response
+    key = cache_key(url, headers if projection is None else [headers, projection.key()])
+    cached = lookup(key)
+    body = read(key) if cached is not None else None
+    request_headers = dict(headers)
+    if body is not None:
+        if is_fresh(cached, max_age):
+            return loads(body) if projection is None else projection.rebuild(loads(body))
+        request_headers.update(validators(cached))
     try:
         if config["debug"]:
             cli.info(f"fetching url {url} - {context.name}")
-        request = get(url, headers=headers)
+        slot = host_slot(url)
+        with slot, limited_get(url, request_headers, slot, stream=projection is not None) as request:
+            # Closed on every path, streamed responses keep their connection until they are closed
+            if request.status_code == 304 and body is not None:
+                revalidated(key)
+                return loads(body) if projection is None else projection.rebuild(loads(body))
+            if request.status_code != 200:
+                report(context.failure_severity, f"WebManager - {context.name} - {context.task}",
+                       f"could not complete request - status code {request.status_code}", software=context.name,
+                       additional=f"URL: {url}")
+                return FaultyStatusCodeException(f"could not complete request - status code {request.status_code}")
+            if projection is None:
+                result = request.json()
+                store(key, url, request)
+                return result
+            extracted = projection.extract(request)  # Parsed while downloading, the connection is still needed
     except Exception as e:
         report(context.failure_severity, f"WebManager - {context.name} - {context.task}",
                "could not complete request - an error occurred.", exception=e, software=context.name,
                additional=f"URL: {url}")
         return e
-    if request.status_code != 200:
-        report(context.failure_severity, f"WebManager - {context.name} - {context.task}",
-               f"could not complete request - status code {request.status_code}", software=context.name,
-               additional=f"URL: {url}")
-        return FaultyStatusCodeException(f"could not complete request - status code {request.status_code}")
-    requests[url] = request.json()
-    return requests[url]
+    store(key, url, request, body=dumps(extracted).encode("utf-8"))
+    return projection.rebuild(extracted)
 
 
 class FaultyStatusCodeException(Exception):